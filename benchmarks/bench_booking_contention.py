@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Contention benchmark for booking date reservation
+
+Fires N concurrent POST /create-booking requests for the same selected_date
+and compares:
+
+    baseline   the previous path: plain INSERT in a worker thread inside the
+               BOOKING_MAX_CONCURRENCY cap, duplicate detected from the
+               database error (DuplicateKeyError)
+    claim      the current path: DateReservations + INSERT ... ON CONFLICT
+               (selected_date) DO NOTHING, only the insert inside the cap
+
+Both paths run with the default settings (BOOKING_MAX_CONCURRENCY=50) on a
+temporary SQLite database. --db-latency-ms adds a sleep to every insert,
+in the worker thread, to model the Supabase round trip.
+
+Usage:
+    python benchmarks/bench_booking_contention.py [--requests 500] [--db-latency-ms 20]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+os.environ.update({
+    "STORAGE_BACKEND": "sqlite",
+    "SQLITE_PATH": os.path.join(tempfile.mkdtemp(), "bench_contention.db"),
+    "RATE_LIMIT_ENABLED": "false",
+    "CRON_ENABLED": "false",
+})
+os.environ.setdefault("TIME_DIFF_LIMIT", "10")
+os.environ.setdefault("AMOUNT", "200")
+
+import httpx  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+import main  # noqa: E402
+from storage import DuplicateKeyError  # noqa: E402
+
+
+def add_latency(storage, latency: float, counter: dict):
+    insert, insert_if_absent = storage.insert, storage.insert_if_absent
+
+    def slow_insert(*args, **kwargs):
+        counter["db_calls"] += 1
+        time.sleep(latency)
+        return insert(*args, **kwargs)
+
+    def slow_insert_if_absent(*args, **kwargs):
+        counter["db_calls"] += 1
+        time.sleep(latency)
+        return insert_if_absent(*args, **kwargs)
+
+    storage.insert, storage.insert_if_absent = slow_insert, slow_insert_if_absent
+
+
+@main.app.post("/bench/baseline-create-booking")
+async def baseline_create_booking(request: main.CreateBookingRequest):
+    """create_booking as it was before the atomic claim"""
+    async with main.booking_concurrency:
+        try:
+            booking_data = {
+                "booking_id": f"booking_{main.uuid.uuid4().hex}",
+                "user_id": request.user_id,
+                "display_name": request.display_name,
+                "selected_date": request.selected_date,
+                "amount": request.amount,
+                "status": request.status,
+            }
+            return await asyncio.to_thread(main.db.insert, "bookings", booking_data)
+        except DuplicateKeyError:
+            raise HTTPException(status_code=409, detail="Booking already exists for this date.")
+
+
+async def fire(client: httpx.AsyncClient, path: str, date: str, requests: int):
+    # Latency is measured from the start of the burst, so time spent queued
+    # (for the thread pool or the date lock) is included
+    async def one(i: int):
+        response = await client.post(path, json={
+            "user_id": f"user_{i}", "display_name": f"User {i}",
+            "selected_date": date, "amount": 200, "status": "pending",
+        })
+        return response.status_code, time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(requests)))
+    wall = time.perf_counter() - start
+    latencies = sorted(latency for _, latency in results)
+    codes = [code for code, _ in results]
+    return {
+        "wall": wall,
+        "p50": statistics.median(latencies),
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+        "created": codes.count(200),
+        "conflict": codes.count(409),
+        "shed": codes.count(503),
+        "other": len(codes) - codes.count(200) - codes.count(409) - codes.count(503),
+    }
+
+
+async def run(requests: int, latency: float):
+    counter = {"db_calls": 0}
+    add_latency(main.db, latency, counter)
+    # One log line per shed or refused request would bury the table
+    logging.disable(logging.WARNING)
+
+    print(f"{requests} concurrent requests for one date, {latency * 1000:.0f} ms simulated DB latency, "
+          f"BOOKING_MAX_CONCURRENCY={main.BOOKING_MAX_CONCURRENCY}")
+    print(f"{'path':<10}{'wall s':>9}{'p50 ms':>9}{'p99 ms':>9}{'created':>9}{'409':>6}{'503':>6}{'other':>7}"
+          f"{'db calls':>10}")
+    async with httpx.AsyncClient(app=main.app, base_url="http://bench") as client:
+        for name, path, date in (
+            ("baseline", "/bench/baseline-create-booking", "2030-01-01"),
+            ("claim", "/create-booking", "2030-01-02"),
+        ):
+            counter["db_calls"] = 0
+            main.date_reservations.release(date)
+            result = await fire(client, path, date, requests)
+            print(f"{name:<10}{result['wall']:>9.2f}{result['p50'] * 1000:>9.0f}{result['p99'] * 1000:>9.0f}"
+                  f"{result['created']:>9}{result['conflict']:>6}{result['shed']:>6}{result['other']:>7}"
+                  f"{counter['db_calls']:>10}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--db-latency-ms", type=float, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.db_latency_ms / 1000))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for list endpoint serialization
+
+Compares rows/second for a 10k-row GET /bookings and GET /payments response:
+
+    baseline   return the rows, FastAPI validates each against response_model
+               and renders with the default JSON encoder (the previous code)
+    adapter    list_response() with TypeAdapter bulk validation (default)
+    trusted    list_response() with TRUST_DB_ROWS=true, orjson only
+
+Storage reads are replaced by an in-memory result, so only validation and
+serialization are measured (through the full ASGI stack via TestClient).
+
+Usage:
+    python benchmarks/bench_list_serialization.py [--rows 10000] [--rounds 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import List
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+for name, value in {
+    "STORAGE_BACKEND": "sqlite",
+    "SQLITE_PATH": ":memory:",
+    "TIME_DIFF_LIMIT": "10",
+    "AMOUNT": "200",
+    "CRON_ENABLED": "false",
+}.items():
+    os.environ.setdefault(name, value)
+
+import main  # noqa: E402
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+def booking_rows(count: int) -> List[dict]:
+    return [{
+        "booking_id": f"booking_1753555238_{i:09d}",
+        "payment_id": f"payment_1753555238_{i:09d}",
+        "user_id": f"U{i:032x}",
+        "display_name": f"Customer {i}",
+        "selected_date": "2025-08-01",
+        "amount": 200,
+        "status": "confirmed" if i % 3 else "pending",
+        "created_at": "2025-07-26T18:40:45.123456",
+    } for i in range(count)]
+
+
+def payment_rows(count: int) -> List[dict]:
+    return [{
+        "payment_id": f"payment_1753555238_{i:09d}",
+        "user_id": f"U{i:032x}",
+        "display_name": f"Customer {i}",
+        "selected_date": "2025-08-01",
+        "amount": 200,
+        "status": "success",
+        "created_at": "2025-07-26T18:40:45.123456",
+        "qr_code_url": "https://example.com/qr.png",
+        "paid_at": "2025-07-27T01:40:38+07:00",
+    } for i in range(count)]
+
+
+def baseline_app(bookings: List[dict], payments: List[dict]) -> FastAPI:
+    """The list endpoints as they were: plain rows + response_model + JSONResponse"""
+    app = FastAPI(default_response_class=JSONResponse)
+
+    @app.get("/bookings", response_model=List[main.Booking])
+    async def get_bookings():
+        return bookings
+
+    @app.get("/payments", response_model=List[main.Payment])
+    async def get_payments():
+        return payments
+
+    return app
+
+
+def measure(client: TestClient, path: str, rows: int, rounds: int) -> float:
+    client.get(path)  # warm-up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        response = client.get(path)
+        assert response.status_code == 200, response.text
+    return rows * rounds / (time.perf_counter() - start)
+
+
+def run(rows: int, rounds: int):
+    bookings = booking_rows(rows)
+    payments = payment_rows(rows)
+
+    def fake_select(table, *args, **kwargs):
+        return bookings if table == "bookings" else payments
+
+    baseline = TestClient(baseline_app(bookings, payments))
+    optimized = TestClient(main.app)
+
+    print(f"{rows:,} rows x {rounds} rounds, rows/second")
+    print(f"{'endpoint':<12}{'baseline':>12}{'adapter':>12}{'trusted':>12}")
+    with mock.patch.object(main.db, "select", side_effect=fake_select):
+        for path in ("/bookings", "/payments"):
+            results = [measure(baseline, path, rows, rounds)]
+            with mock.patch.object(main, "TRUST_DB_ROWS", False):
+                results.append(measure(optimized, path, rows, rounds))
+            with mock.patch.object(main, "TRUST_DB_ROWS", True):
+                results.append(measure(optimized, path, rows, rounds))
+            print(f"{path:<12}" + "".join(f"{result:>12,.0f}" for result in results)
+                  + f"   ({results[1] / results[0]:.1f}x / {results[2] / results[0]:.1f}x)")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    run(args.rows, args.rounds)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Row size of a verified payment in legacy vs compact metadata mode
+
+Builds the row /verify-slip-with-validation would insert for a sample EasySlip
+response in both PAYMENT_METADATA_MODE settings and reports the JSON size of
+the payments row, of what GET /payments transfers per row, and of the raw
+payment_slip_raw entry (zlib as a stand-in for the lz4 TOAST compression).
+
+For the real numbers on a database, run the row-size query at the top of
+migrations/001_compact_payment_metadata.sql before and after the migration.
+
+Usage:
+    python benchmarks/bench_payment_row_size.py
+"""
+
+import json
+import os
+import sys
+import zlib
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+for name, value in {
+    "STORAGE_BACKEND": "sqlite",
+    "SQLITE_PATH": ":memory:",
+    "TIME_DIFF_LIMIT": "10",
+    "AMOUNT": "200",
+}.items():
+    os.environ.setdefault(name, value)
+
+import main  # noqa: E402
+
+SAMPLE_EASYSLIP_RESPONSE = {
+    "status": 200,
+    "data": {
+        "payload": "0038000600000101030060217A4fa65d187c1549805102TH9104FCAF",
+        "transRef": "A4fa65d187c154980",
+        "date": "2025-07-27T01:40:38+07:00",
+        "countryCode": "TH",
+        "amount": {"amount": 200, "local": {"amount": 0, "currency": ""}},
+        "fee": 0,
+        "ref1": "", "ref2": "", "ref3": "",
+        "sender": {
+            "bank": {"id": "006", "name": "ธนาคารกรุงไทย", "short": "KTB"},
+            "account": {
+                "name": {"th": "นายธนานันต์ เ", "en": "MR.Tananun H"},
+                "bank": {"type": "BANKAC", "account": "xxx-x-x1234-x"},
+            },
+        },
+        "receiver": {
+            "bank": {"id": "014", "name": "ธนาคารไทยพาณิชย์", "short": "SCB"},
+            "account": {
+                "name": {"th": "น.ส. พรปวีณ์ ส", "en": "MS. Ponprawee S"},
+                "bank": {"type": "BANKAC", "account": "xxx-x-x5678-x"},
+                "proxy": {"type": "MSISDN", "account": "xxx-xxx-1234"},
+            },
+        },
+    },
+}
+
+
+def payment_row(mode: str) -> dict:
+    easyslip_result = main.EasySlipResponse(**SAMPLE_EASYSLIP_RESPONSE)
+    with mock.patch.object(main, "PAYMENT_METADATA_MODE", mode):
+        slip_data = main.build_slip_payment_data(easyslip_result.data)
+    return {
+        "id": 12345,
+        "payment_id": "payment_1753555238_abc123def",
+        "user_id": "U1234567890abcdef1234567890abcdef",
+        "display_name": "John Doe",
+        "selected_date": "2025-08-01",
+        "amount": 200.0,
+        "status": "success",
+        "status_code": "200",
+        "response": "Payment verified successfully",
+        "paid_at": easyslip_result.data.date,
+        "created_at": "2025-07-26T18:40:45.123456",
+        "qr_code_url": None,
+        "slip_url": "https://example.supabase.co/storage/v1/object/public/payment-slips/slips/1753555238_slip.jpg",
+        **slip_data,
+    }
+
+
+def size(value) -> int:
+    return len(json.dumps(value, ensure_ascii=False).encode())
+
+
+def run():
+    legacy = payment_row("legacy")
+    compact = payment_row("compact")
+    list_columns = [column.strip() for column in main.PAYMENT_LIST_COLUMNS.split(",")]
+    raw = json.dumps(SAMPLE_EASYSLIP_RESPONSE, ensure_ascii=False).encode()
+
+    print(f"{'':<36}{'legacy':>10}{'compact':>10}")
+    print(f"{'payments row (bytes)':<36}{size(legacy):>10}{size(compact):>10}")
+    print(f"{'GET /payments per row, select *':<36}{size(legacy):>10}")
+    print(f"{'GET /payments per row, list columns':<36}{size({c: compact.get(c) for c in list_columns}):>10}")
+    print(f"{'payment_slip_raw entry':<36}{'':>10}{len(raw):>10}")
+    print(f"{'payment_slip_raw entry, compressed':<36}{'':>10}{len(zlib.compress(raw)):>10}")
+
+
+if __name__ == "__main__":
+    run()
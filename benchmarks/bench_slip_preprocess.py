@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark for slip image preprocessing (slip_image.py)
+
+Measures bytes saved and the end-to-end latency of preparing a slip and
+uploading it twice (EasySlip + Supabase Storage) at a given uplink speed.
+
+Usage:
+    python benchmarks/bench_slip_preprocess.py                 # synthetic 12MP phone photo
+    python benchmarks/bench_slip_preprocess.py slip1.jpg slip2.png --uplink-mbps 20
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from slip_image import SlipImagePreprocessor  # noqa: E402
+
+
+def synthetic_phone_photo() -> bytes:
+    """A 4000x3000 noisy photo with a QR-like block pattern and EXIF, similar to a camera shot of a slip"""
+    random.seed(42)
+    image = Image.effect_noise((4000, 3000), 40).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((1200, 600, 2800, 2400), fill=(250, 250, 250))
+    for x in range(25):
+        for y in range(25):
+            if random.random() < 0.5:
+                draw.rectangle((1500 + x * 40, 900 + y * 40, 1540 + x * 40, 940 + y * 40), fill=(0, 0, 0))
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"
+    exif[0x0132] = "2025:07:27 01:40:38"
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=95, exif=exif)
+    return output.getvalue()
+
+
+async def run(images, uplink_mbps: float, rounds: int):
+    bytes_per_second = uplink_mbps * 1_000_000 / 8
+    disabled = SlipImagePreprocessor(enabled=False)
+    enabled = SlipImagePreprocessor(enabled=True)
+    # Warm the process pool so worker start-up is not billed to the first image
+    await enabled.prepare(images[0][1], images[0][0])
+
+    print(f"{'image':<24}{'original':>12}{'processed':>12}{'saved':>8}{'prep ms':>10}{'e2e before':>12}{'e2e after':>12}")
+    for name, content in images:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            await disabled.prepare(content, name)
+        base_prep = (time.perf_counter() - start) / rounds
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            slip = await enabled.prepare(content, name)
+        prep = (time.perf_counter() - start) / rounds
+
+        # Two uploads per verification: EasySlip and Supabase Storage
+        e2e_before = base_prep + 2 * len(content) / bytes_per_second
+        e2e_after = prep + 2 * len(slip.content) / bytes_per_second
+        saved = 1 - len(slip.content) / len(content)
+        print(f"{name[:23]:<24}{len(content):>12,}{len(slip.content):>12,}{saved:>7.0%}"
+              f"{prep * 1000:>10.1f}{e2e_before * 1000:>10.0f}ms{e2e_after * 1000:>10.0f}ms")
+    enabled.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="slip images to benchmark (default: synthetic photo)")
+    parser.add_argument("--uplink-mbps", type=float, default=10.0, help="uplink bandwidth used for transfer time")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.images:
+        images = [(os.path.basename(path), open(path, "rb").read()) for path in args.images]
+    else:
+        images = [("synthetic_12mp.jpg", synthetic_phone_photo())]
+    asyncio.run(run(images, args.uplink_mbps, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Background dependency probes for the readiness endpoint.
+
+Probes run on a fixed interval in a background task and their last result is
+cached, so /health/ready costs the same no matter how often the load balancer
+or Docker calls it. Event-loop lag comes from the LoopMonitor, as the p99 over
+the last `loop_lag_window` seconds: the latest sample alone misses a stall
+that ended just before the check and fails on a single slow callback.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from loop_monitor import LoopMonitor
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    def __init__(self, probes: Dict[str, Callable[[], Awaitable[None]]], required: Iterable[str],
+                 loop_monitor: LoopMonitor, interval: float = 15.0, timeout: float = 5.0,
+                 max_loop_lag_ms: float = 1000.0, loop_lag_window: float = 5.0):
+        self.probes = probes
+        self.required = set(required)
+        self.loop_monitor = loop_monitor
+        self.interval = interval
+        self.timeout = timeout
+        self.max_loop_lag_ms = max_loop_lag_ms
+        self.loop_lag_window = loop_lag_window
+        self.results: Dict[str, dict] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run_probe(self, name: str, probe: Callable[[], Awaitable[None]]):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(probe(), timeout=self.timeout)
+            result = {"ok": True, "error": None}
+        except asyncio.TimeoutError:
+            result = {"ok": False, "error": f"timed out after {self.timeout:.0f}s"}
+        except Exception as e:
+            result = {"ok": False, "error": str(e) or type(e).__name__}
+        result.update({
+            "required": name in self.required,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            "checked_at": datetime.now().isoformat(),
+        })
+        if not result["ok"] and self.results.get(name, {}).get("ok", True):
+            logger.warning(f"Health probe {name} failed: {result['error']}")
+        self.results[name] = result
+
+    async def probe_all(self):
+        await asyncio.gather(*(self._run_probe(name, probe) for name, probe in self.probes.items()))
+
+    async def _probe_loop(self):
+        while True:
+            await self.probe_all()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._probe_loop(), name="health-probes")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def readiness(self) -> dict:
+        """Cached readiness report; never probes inline"""
+        missing = [name for name in self.required if name not in self.results]
+        failing = [name for name in self.required if name in self.results and not self.results[name]["ok"]]
+        reasons = []
+        if missing:
+            reasons.append(f"waiting for first probe: {', '.join(sorted(missing))}")
+        if failing:
+            reasons.append(f"failing: {', '.join(sorted(failing))}")
+        loop_lag = self.loop_monitor.lag_stats(window=self.loop_lag_window)
+        if loop_lag["p99_ms"] > self.max_loop_lag_ms:
+            reasons.append(
+                f"event loop lag p99 {loop_lag['p99_ms']:.0f}ms over {self.max_loop_lag_ms:.0f}ms "
+                f"in the last {loop_lag['window_seconds']:.0f}s"
+            )
+        return {
+            "ready": not reasons,
+            "reasons": reasons,
+            "checks": self.results,
+            "event_loop_lag": loop_lag,
+        }
+
+
+async def http_probe(client_factory: Callable, url: str, headers: Optional[dict] = None):
+    """GET `url` and raise unless it answers 200"""
+    async with client_factory() as client:
+        response = await client.get(url, headers=headers)
+    if response.status_code != 200:
+        raise Exception(f"HTTP {response.status_code}")
@@ -0,0 +1,236 @@
+"""
+Event-loop lag sampling and blocking-call detection.
+
+A watchdog thread schedules a no-op on the event loop every `interval` seconds
+and measures how long the loop takes to run it (the loop lag). When the loop
+has not answered after `threshold` seconds, something is blocking it, e.g. a
+synchronous Supabase call inside an `async def` handler; the watchdog then
+grabs the loop thread's current stack with sys._current_frames(), so the
+blocking call itself shows up in the trace, and records it with the endpoint
+whose request was running.
+
+Blocks shorter than `threshold` are only visible as lag, and a block has to
+last about `threshold + interval` to be caught for certain.
+
+In strict mode a request that blocked the loop raises EventLoopBlockedError
+once the endpoint returns, which fails the test when run under TestClient.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class EventLoopBlockedError(RuntimeError):
+    """Raised in strict mode when an endpoint blocked the event loop"""
+
+
+class _ActiveRequest:
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.events: List[dict] = []
+
+    @property
+    def endpoint(self) -> str:
+        # FastAPI stores the matched route in the scope, so labels stay low-cardinality
+        route = self.scope.get("route")
+        return f"{self.scope.get('method', '')} {route.path if route else '<unmatched>'}"
+
+
+class LoopMonitor:
+    def __init__(self, enabled: bool = True, threshold: float = 0.1, interval: float = 0.05,
+                 strict: bool = False, max_events: int = 50, lag_window: float = 60.0, stack_limit: int = 25):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.interval = interval
+        self.strict = strict
+        self.stack_limit = stack_limit
+        self.lag_window = lag_window
+        # (time.monotonic() when measured, lag in seconds)
+        self._lag_samples = deque(maxlen=max(1, int(lag_window / interval)))
+        self._events = deque(maxlen=max_events)
+        self._blocked_count: Dict[str, int] = {}
+        self._blocked_seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # id(frame of LoopMonitorMiddleware.__call__) -> request it is serving
+        self._requests: Dict[int, _ActiveRequest] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start watching the running event loop; call from inside the loop"""
+        if not self.enabled or self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=max(1.0, self.threshold * 2))
+        self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            answered = threading.Event()
+            answered_at = []
+
+            def ping():
+                answered_at.append(time.perf_counter())
+                answered.set()
+
+            sent_at = time.perf_counter()
+            try:
+                self._loop.call_soon_threadsafe(ping)
+            except RuntimeError:
+                # Loop closed without stop() being called
+                return
+
+            event = None
+            if not answered.wait(self.threshold):
+                event = self._capture()
+                while not answered.wait(0.1):
+                    if self._stop.is_set():
+                        return
+
+            lag = answered_at[0] - sent_at
+            self._lag_samples.append((time.monotonic(), lag))
+            if event is not None:
+                self._finish(event, lag)
+
+    def _capture(self) -> Optional[dict]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+        stack = traceback.format_stack(frame, limit=self.stack_limit)
+
+        request = None
+        f = frame
+        while f is not None and request is None:
+            request = self._requests.get(id(f))
+            f = f.f_back
+
+        event = {
+            "endpoint": request.endpoint if request else None,
+            "detected_at": datetime.now().isoformat(),
+            "duration_ms": None,
+            "stack": stack,
+        }
+        if request is not None:
+            request.events.append(event)
+        with self._lock:
+            self._events.append(event)
+        return event
+
+    def _finish(self, event: dict, blocked_for: float):
+        endpoint = event["endpoint"] or "<background>"
+        with self._lock:
+            event["duration_ms"] = round(blocked_for * 1000, 1)
+            self._blocked_count[endpoint] = self._blocked_count.get(endpoint, 0) + 1
+            self._blocked_seconds[endpoint] = self._blocked_seconds.get(endpoint, 0.0) + blocked_for
+        logger.warning(
+            f"Event loop blocked for {event['duration_ms']:.0f}ms in {endpoint}:\n" + "".join(event["stack"])
+        )
+
+    def lag_stats(self, window: Optional[float] = None) -> dict:
+        """Lag over the last `window` seconds (default: all of `lag_window`)"""
+        window = self.lag_window if window is None else min(window, self.lag_window)
+        since = time.monotonic() - window
+        recent = [lag for measured_at, lag in list(self._lag_samples) if measured_at >= since]
+        samples = sorted(recent)
+        return {
+            "current_ms": round(recent[-1] * 1000, 1) if recent else 0.0,
+            "p99_ms": round(samples[int(len(samples) * 0.99)] * 1000, 1) if samples else 0.0,
+            "max_ms": round(samples[-1] * 1000, 1) if samples else 0.0,
+            "window_seconds": window,
+        }
+
+    def report(self) -> dict:
+        with self._lock:
+            events = [dict(event) for event in reversed(self._events)]
+            blocked = {
+                endpoint: {"count": count, "total_ms": round(self._blocked_seconds[endpoint] * 1000, 1)}
+                for endpoint, count in self._blocked_count.items()
+            }
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "strict": self.strict,
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "event_loop_lag": self.lag_stats(),
+            "blocked_by_endpoint": blocked,
+            "recent_blocking_calls": events,
+        }
+
+    def prometheus_metrics(self) -> str:
+        """Metrics in the Prometheus text exposition format"""
+        lag = self.lag_stats()
+        lines = [
+            "# HELP event_loop_lag_seconds Latest measured event-loop lag.",
+            "# TYPE event_loop_lag_seconds gauge",
+            f"event_loop_lag_seconds {lag['current_ms'] / 1000:.4f}",
+            f"# HELP event_loop_lag_max_seconds Largest event-loop lag in the last {lag['window_seconds']:.0f}s.",
+            "# TYPE event_loop_lag_max_seconds gauge",
+            f"event_loop_lag_max_seconds {lag['max_ms'] / 1000:.4f}",
+            "# HELP event_loop_blocking_calls_total Callbacks that blocked the event loop longer than the threshold.",
+            "# TYPE event_loop_blocking_calls_total counter",
+        ]
+        with self._lock:
+            counts = dict(self._blocked_count)
+            seconds = dict(self._blocked_seconds)
+        for endpoint, count in counts.items():
+            lines.append(f'event_loop_blocking_calls_total{{endpoint="{endpoint}"}} {count}')
+        lines += [
+            "# HELP event_loop_blocked_seconds_total Time the event loop spent blocked by those callbacks.",
+            "# TYPE event_loop_blocked_seconds_total counter",
+        ]
+        for endpoint, total in seconds.items():
+            lines.append(f'event_loop_blocked_seconds_total{{endpoint="{endpoint}"}} {total:.6f}')
+        return "\n".join(lines) + "\n"
+
+
+class LoopMonitorMiddleware:
+    """ASGI middleware that tells the monitor which request is running and enforces strict mode"""
+
+    def __init__(self, app, monitor: LoopMonitor):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.monitor.running:
+            await self.app(scope, receive, send)
+            return
+
+        # The watchdog finds this frame by walking the loop thread's stack
+        key = id(sys._getframe())
+        request = _ActiveRequest(scope)
+        self.monitor._requests[key] = request
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            del self.monitor._requests[key]
+
+        if request.events and self.monitor.strict:
+            # The block may have ended too recently for its duration to be known yet
+            raise EventLoopBlockedError(
+                f"{request.endpoint} blocked the event loop for more than {self.monitor.threshold * 1000:.0f}ms:\n"
+                + "".join(request.events[-1]["stack"])
+            )
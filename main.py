@@ -1,6 +1,7 @@
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, TypeAdapter
 from typing import Optional, List
 import os
 from datetime import datetime, timezone, timedelta
@@ -14,6 +15,13 @@ import logging
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from contextlib import asynccontextmanager
+from rate_limit import RateLimit, RateLimiter, ConcurrencyLimiter, create_rate_limit_backend
+from slip_image import SlipImagePreprocessor
+from slip_qr import SlipQRDecoder, RecentTransRefs, parse_slip_payload
+from storage import create_storage, utc_now_iso
+from reservations import DateReservations
+from health import HealthMonitor, http_probe
+from loop_monitor import LoopMonitor, LoopMonitorMiddleware
 
 # Load environment variables
 load_dotenv(override=True)
@@ -21,17 +29,24 @@ load_dotenv(override=True)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    loop_monitor.start()
     start_scheduler()
+    health_monitor.start()
     yield
     # Shutdown
+    await health_monitor.stop()
+    loop_monitor.stop()
     stop_scheduler()
+    slip_preprocessor.shutdown()
+    slip_qr_decoder.shutdown()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Clip Booking API",
     description="API for managing clip editing bookings with payment integration",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -57,14 +72,120 @@ receiver_name = os.getenv("RECEIVER_NAME")
 BOOKING_CLEANUP_MINUTES = int(os.getenv("BOOKING_CLEANUP_MINUTES", "10"))
 CRON_ENABLED = os.getenv("CRON_ENABLED", "true").lower() == "true"
 
-if not supabase_url or not supabase_key:
+# Rate limiting Configuration
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+REDIS_URL = os.getenv("REDIS_URL")
+VERIFY_RATE_PER_MINUTE = float(os.getenv("VERIFY_RATE_PER_MINUTE", "5"))
+VERIFY_RATE_BURST = int(os.getenv("VERIFY_RATE_BURST", "5"))
+VERIFY_MAX_CONCURRENCY = int(os.getenv("VERIFY_MAX_CONCURRENCY", "20"))
+BOOKING_RATE_PER_MINUTE = float(os.getenv("BOOKING_RATE_PER_MINUTE", "10"))
+BOOKING_RATE_BURST = int(os.getenv("BOOKING_RATE_BURST", "10"))
+# Per client IP; looser than the per-user limits because users behind one NAT share an IP
+VERIFY_IP_RATE_PER_MINUTE = float(os.getenv("VERIFY_IP_RATE_PER_MINUTE", "60"))
+VERIFY_IP_RATE_BURST = int(os.getenv("VERIFY_IP_RATE_BURST", "20"))
+BOOKING_IP_RATE_PER_MINUTE = float(os.getenv("BOOKING_IP_RATE_PER_MINUTE", "120"))
+BOOKING_IP_RATE_BURST = int(os.getenv("BOOKING_IP_RATE_BURST", "40"))
+BOOKING_MAX_CONCURRENCY = int(os.getenv("BOOKING_MAX_CONCURRENCY", "50"))
+BOOKING_DATE_CACHE_SECONDS = float(os.getenv("BOOKING_DATE_CACHE_SECONDS", "5"))
+
+# Slip image preprocessing Configuration
+SLIP_PREPROCESS_ENABLED = os.getenv("SLIP_PREPROCESS_ENABLED", "false").lower() == "true"
+SLIP_MAX_DIMENSION = int(os.getenv("SLIP_MAX_DIMENSION", "1600"))
+SLIP_JPEG_QUALITY = int(os.getenv("SLIP_JPEG_QUALITY", "85"))
+SLIP_TARGET_BYTES = int(os.getenv("SLIP_TARGET_BYTES", "500000"))
+SLIP_PREPROCESS_WORKERS = int(os.getenv("SLIP_PREPROCESS_WORKERS", "2"))
+
+# Local slip QR precheck Configuration
+SLIP_QR_PRECHECK_ENABLED = os.getenv("SLIP_QR_PRECHECK_ENABLED", "false").lower() == "true"
+SLIP_QR_REJECT_UNREADABLE = os.getenv("SLIP_QR_REJECT_UNREADABLE", "true").lower() == "true"
+SLIP_QR_WORKERS = int(os.getenv("SLIP_QR_WORKERS", "2"))
+
+# Payment metadata storage: "legacy" keeps everything in payments.metadata,
+# "compact" uses the promoted columns + payment_slip_raw (migrations/001_compact_payment_metadata.sql)
+PAYMENT_METADATA_MODE = os.getenv("PAYMENT_METADATA_MODE", "legacy").lower()
+
+# List endpoints: skip per-row validation and serialize database rows as-is
+TRUST_DB_ROWS = os.getenv("TRUST_DB_ROWS", "false").lower() == "true"
+
+# Storage Configuration: "supabase" or "sqlite" for bookings/payments tables
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "clip_booking.db")
+
+# Health Configuration: /health/ready reports cached results of background probes
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "15"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "5"))
+# Probes that must pass for readiness; the others are reported but don't fail it
+READINESS_REQUIRED_CHECKS = [c.strip() for c in os.getenv("READINESS_REQUIRED_CHECKS", "database").split(",") if c.strip()]
+READINESS_MAX_LOOP_LAG_MS = float(os.getenv("READINESS_MAX_LOOP_LAG_MS", "1000"))
+# Readiness compares the p99 loop lag over this many seconds against READINESS_MAX_LOOP_LAG_MS
+READINESS_LOOP_LAG_WINDOW = float(os.getenv("READINESS_LOOP_LAG_WINDOW", "5"))
+# Cheap authenticated EasySlip endpoint; defaults to /me next to the verify endpoint
+EASYSLIP_HEALTH_URL = os.getenv("EASYSLIP_HEALTH_URL") or (easyslip_url.rsplit("/", 1)[0] + "/me" if easyslip_url else None)
+
+# Event Loop Monitor Configuration: samples loop lag and records stacks of blocking calls
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+LOOP_MONITOR_INTERVAL_MS = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "50"))
+# Strict mode (for tests): a request that blocked the loop raises EventLoopBlockedError
+LOOP_MONITOR_STRICT = os.getenv("LOOP_MONITOR_STRICT", "false").lower() == "true"
+# /debug/event-loop returns stack traces, so it is only served when explicitly enabled
+LOOP_MONITOR_DEBUG_ENDPOINT = os.getenv("LOOP_MONITOR_DEBUG_ENDPOINT", "false").lower() == "true"
+
+if STORAGE_BACKEND == "supabase" and (not supabase_url or not supabase_key):
     raise ValueError("SUPABASE_URL and SUPABASE_ANON_KEY must be set in environment variables")
 
-supabase: Client = create_client(supabase_url, supabase_key)
+# Supabase is optional with SQLite storage; it is then only used for slip uploads if configured
+supabase: Optional[Client] = create_client(supabase_url, supabase_key) if supabase_url and supabase_key else None
+
+db = create_storage(STORAGE_BACKEND, supabase_client=supabase, sqlite_path=SQLITE_PATH)
+
+# Per-date claim queue + short "date taken" cache in front of the bookings insert
+date_reservations = DateReservations(taken_ttl=BOOKING_DATE_CACHE_SECONDS)
 
 # Initialize scheduler for cronjobs
 scheduler = AsyncIOScheduler()
 
+# Event loop monitor (attributes blocking calls to the request that made them)
+loop_monitor = LoopMonitor(
+    enabled=LOOP_MONITOR_ENABLED,
+    threshold=LOOP_BLOCK_THRESHOLD_MS / 1000,
+    interval=LOOP_MONITOR_INTERVAL_MS / 1000,
+    strict=LOOP_MONITOR_STRICT
+)
+app.add_middleware(LoopMonitorMiddleware, monitor=loop_monitor)
+
+# Initialize rate limiting and admission control
+rate_limiter = RateLimiter(
+    backend=create_rate_limit_backend(RATE_LIMIT_BACKEND, REDIS_URL),
+    limits={
+        "verify_slip": RateLimit(per_minute=VERIFY_RATE_PER_MINUTE, burst=VERIFY_RATE_BURST),
+        "create_booking": RateLimit(per_minute=BOOKING_RATE_PER_MINUTE, burst=BOOKING_RATE_BURST),
+    },
+    ip_limits={
+        "verify_slip": RateLimit(per_minute=VERIFY_IP_RATE_PER_MINUTE, burst=VERIFY_IP_RATE_BURST),
+        "create_booking": RateLimit(per_minute=BOOKING_IP_RATE_PER_MINUTE, burst=BOOKING_IP_RATE_BURST),
+    },
+    enabled=RATE_LIMIT_ENABLED,
+    trust_proxy=RATE_LIMIT_TRUST_PROXY
+)
+verify_concurrency = ConcurrencyLimiter("verify_slip", VERIFY_MAX_CONCURRENCY)
+booking_concurrency = ConcurrencyLimiter("create_booking", BOOKING_MAX_CONCURRENCY)
+
+# Initialize slip image preprocessing (runs in a process pool, off the event loop)
+slip_preprocessor = SlipImagePreprocessor(
+    enabled=SLIP_PREPROCESS_ENABLED,
+    max_dimension=SLIP_MAX_DIMENSION,
+    jpeg_quality=SLIP_JPEG_QUALITY,
+    target_bytes=SLIP_TARGET_BYTES,
+    max_workers=SLIP_PREPROCESS_WORKERS
+)
+
+# Initialize local slip QR precheck (decodes in a process pool before calling EasySlip)
+slip_qr_decoder = SlipQRDecoder(enabled=SLIP_QR_PRECHECK_ENABLED, max_workers=SLIP_QR_WORKERS)
+verified_trans_refs = RecentTransRefs()
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -114,9 +235,12 @@ class Payment(BaseModel):
     amount: float
     status: str
     created_at: str
-    qr_code_url: str
+    qr_code_url: Optional[str] = None
     paid_at: Optional[str] = None
 
+booking_list_adapter = TypeAdapter(List[Booking])
+payment_list_adapter = TypeAdapter(List[Payment])
+
 class CreateBookingRequest(BaseModel):
     user_id: str
     display_name: str
@@ -171,7 +295,7 @@ class EasySlipResponse(BaseModel):
     message: Optional[str] = None
 
 
-async def verify_slip_with_easyslip(file_content: bytes, filename: str) -> EasySlipResponse:
+async def verify_slip_with_easyslip(file_content: bytes, filename: str, content_type: str = "image/jpeg", check_duplicate: bool = True) -> EasySlipResponse:
     """Verify slip using EasySlip API"""
     try:
         # Get EasySlip API token from environment
@@ -186,10 +310,10 @@ async def verify_slip_with_easyslip(file_content: bytes, filename: str) -> EasyS
         
         # Create form data with checkDuplicate parameter
         files = {
-            "file": (filename, file_content, "image/jpeg")
+            "file": (filename, file_content, content_type)
         }
         data = {
-            "checkDuplicate": "true"
+            "checkDuplicate": "true" if check_duplicate else "false"
         }
         
         async with httpx.AsyncClient() as client:
@@ -214,9 +338,131 @@ async def verify_slip_with_easyslip(file_content: bytes, filename: str) -> EasyS
             message="Internal server error"
         )
 
+def validate_slip_data(data: EasySlipData, expected_amount: float, reference_time: Optional[datetime] = None) -> List[str]:
+    """Business validation rules for a slip EasySlip has read; returns the list of errors"""
+    validation_errors = []
+    
+    # Check 2: Date within 10 minutes of current time (or of reference_time when re-verifying old rows)
+    # ใช้เวลาปัจจุบันใน timezone ไทย
+    thailand_tz = timezone(timedelta(hours=7))
+    current_time = reference_time or datetime.now(thailand_tz)  # เวลาปัจจุบันใน timezone ไทย
+    slip_date = datetime.fromisoformat(data.date)  # +07:00
+    time_diff = abs((slip_date - current_time).total_seconds() / 60)
+    
+    if time_diff > time_diff_limit:
+        validation_errors.append(f"Payment time difference is {time_diff:.1f} minutes, must be within 10 minutes")
+    
+    if data.amount.amount != expected_amount:
+        validation_errors.append(f"Amount is {data.amount.amount}, must be {expected_amount}")
+    
+    receiver_name_th = data.receiver.account.name.th
+    if receiver_name_th != receiver_name:
+        validation_errors.append(f"Receiver name is '{receiver_name_th}', must be '{receiver_name}'")
+    
+    return validation_errors
+
+# Columns returned by the list endpoints; everything the response models need and nothing more
+BOOKING_LIST_COLUMNS = "booking_id, payment_id, user_id, display_name, selected_date, amount, status, created_at"
+PAYMENT_LIST_COLUMNS = "payment_id, user_id, display_name, selected_date, amount, status, created_at, qr_code_url, paid_at"
+
+def list_response(rows: List[dict], adapter: TypeAdapter) -> Response:
+    """
+    Serialize a list of database rows in one pass.
+    
+    Returning a Response skips FastAPI's per-row response_model validation and
+    jsonable_encoder; the rows are validated in bulk by the TypeAdapter instead
+    (pydantic-core, straight to JSON bytes), or not at all with TRUST_DB_ROWS.
+    """
+    if TRUST_DB_ROWS:
+        return ORJSONResponse(rows)
+    return Response(content=adapter.dump_json(adapter.validate_python(rows)), media_type="application/json")
+
+def build_slip_payment_data(data: EasySlipData) -> dict:
+    """Payment columns taken from a verified slip"""
+    if PAYMENT_METADATA_MODE == "compact":
+        # The full EasySlip response goes to payment_slip_raw via save_raw_easyslip_result
+        return {
+            "tran_ref": data.transRef,
+            "sender_bank": data.sender.bank.name,
+            "sender_name": data.sender.account.name.th,
+            "receiver_name": data.receiver.account.name.th,
+            "transaction_date": data.date,
+            "fee": data.fee,
+            "payload": data.payload
+        }
+    return {
+        "tran_ref": data.transRef,
+        "metadata": {
+            "easyslip_data": data.model_dump(),
+            "sender_bank": data.sender.bank.name,
+            "sender_name": data.sender.account.name.th,
+            "receiver_name": data.receiver.account.name.th,
+            "transaction_date": data.date,
+            "country_code": data.countryCode,
+            "fee": data.fee,
+            "payload": data.payload
+        }
+    }
+
+def save_raw_easyslip_result(payment_id: str, easyslip_result: EasySlipResponse):
+    """
+    Store the full EasySlip response outside the payments row (compact mode only).
+    
+    Called after the payments row is committed, so a failure here is only
+    logged: raising would return 500 for a payment that was recorded, and the
+    client's retry would then hit the payment_id unique key.
+    """
+    if PAYMENT_METADATA_MODE != "compact":
+        return
+    try:
+        db.upsert("payment_slip_raw", [{
+            "payment_id": payment_id,
+            "easyslip_response": easyslip_result.model_dump()
+        }], on_conflict="payment_id")
+    except Exception as e:
+        logger.error(f"Error saving raw EasySlip response for payment {payment_id}: {e}")
+
+async def precheck_slip(file_content: bytes) -> Optional[EasySlipResponse]:
+    """Decode the slip QR locally; return an error response to skip EasySlip, or None to continue"""
+    if not slip_qr_decoder.enabled:
+        return None
+    
+    try:
+        raw_payload = await slip_qr_decoder.decode(file_content)
+    except Exception as e:
+        logger.error(f"Error decoding slip QR locally: {e}")
+        return None
+    
+    if not raw_payload:
+        if SLIP_QR_REJECT_UNREADABLE:
+            return EasySlipResponse(status=400, message="qrcode_not_found")
+        return None
+    
+    slip_payload = parse_slip_payload(raw_payload)
+    if slip_payload is None:
+        # A readable QR that is not a transfer slip, e.g. the PromptPay QR itself
+        return EasySlipResponse(status=400, message="invalid_payload")
+    
+    if slip_payload.trans_ref in verified_trans_refs:
+        return EasySlipResponse(status=400, message="duplicate_slip")
+    
+    try:
+        rows = await asyncio.to_thread(
+            db.select, "payments", "payment_id", {"tran_ref": slip_payload.trans_ref, "status": "success"}, limit=1
+        )
+        if rows:
+            verified_trans_refs.add(slip_payload.trans_ref)
+            return EasySlipResponse(status=400, message="duplicate_slip")
+    except Exception as e:
+        logger.error(f"Error checking duplicate slip {slip_payload.trans_ref}: {e}")
+    
+    return None
+
 async def upload_file_to_supabase_storage(file_content: bytes, filename: str, content_type: str, bucket_name: str = slip_bucket_name) -> str:
 
     try:
+        if supabase is None:
+            raise Exception("Supabase Storage not configured")
 
         storage_filename = f"slips/{int(datetime.now().timestamp())}_{filename}"
         
@@ -234,32 +480,54 @@ async def upload_file_to_supabase_storage(file_content: bytes, filename: str, co
         print(f"Error uploading file: {e}")
         return None
 
+async def probe_database():
+    await asyncio.to_thread(db.ping)
+
+async def probe_slip_bucket():
+    if supabase is None or not slip_bucket_name:
+        raise Exception("Supabase Storage not configured")
+    await asyncio.to_thread(supabase.storage.from_(slip_bucket_name).list, "slips", {"limit": 1})
+
+async def probe_easyslip():
+    if not easyslip_token or not EASYSLIP_HEALTH_URL:
+        raise Exception("EASYSLIP_TOKEN not configured")
+    await http_probe(
+        lambda: httpx.AsyncClient(timeout=HEALTH_PROBE_TIMEOUT),
+        EASYSLIP_HEALTH_URL,
+        headers={"Authorization": f"Bearer {easyslip_token}"}
+    )
+
+# Dependency probes run in the background; readiness only reads their last result
+health_monitor = HealthMonitor(
+    probes={"database": probe_database, "slip_bucket": probe_slip_bucket, "easyslip": probe_easyslip},
+    required=READINESS_REQUIRED_CHECKS,
+    loop_monitor=loop_monitor,
+    interval=HEALTH_PROBE_INTERVAL,
+    timeout=HEALTH_PROBE_TIMEOUT,
+    max_loop_lag_ms=READINESS_MAX_LOOP_LAG_MS,
+    loop_lag_window=READINESS_LOOP_LAG_WINDOW
+)
+
 async def cleanup_old_bookings():
     """Clean up pending bookings older than BOOKING_CLEANUP_MINUTES"""
     try:
         logger.info("Starting cleanup of old pending bookings...")
         
         # Calculate cutoff time
-        cutoff_time = datetime.now() - timedelta(minutes=BOOKING_CLEANUP_MINUTES)
+        cutoff_time = datetime.now(timezone.utc) - timedelta(minutes=BOOKING_CLEANUP_MINUTES)
         
-        # Get old pending bookings only
-        result = supabase.table("bookings").select("booking_id, created_at, status").lt("created_at", cutoff_time.isoformat()).eq("status", "pending").execute()
+        # Delete old pending bookings only, in a single statement
+        deleted = await asyncio.to_thread(db.delete_expired, "bookings", older_than=cutoff_time, status="pending")
         
-        if not result.data:
+        if not deleted:
             logger.info("No old pending bookings found to clean up")
             return
         
-        # Delete old pending bookings
-        deleted_count = 0
-        for booking in result.data:
-            try:
-                supabase.table("bookings").delete().eq("booking_id", booking["booking_id"]).execute()
-                deleted_count += 1
-                logger.info(f"Deleted old pending booking: {booking['booking_id']}")
-            except Exception as e:
-                logger.error(f"Error deleting booking {booking['booking_id']}: {e}")
+        for booking in deleted:
+            date_reservations.release(booking.get("selected_date"))
+            logger.info(f"Deleted old pending booking: {booking['booking_id']}")
         
-        logger.info(f"Cleanup completed. Deleted {deleted_count} old pending bookings")
+        logger.info(f"Cleanup completed. Deleted {len(deleted)} old pending bookings")
         
     except Exception as e:
         logger.error(f"Error in cleanup_old_bookings: {e}")
@@ -309,13 +577,13 @@ async def generate_payment(
             "selected_date": request.selected_date,
             "amount": request.amount,
             "status": "pending",
-            "created_at": datetime.now().isoformat(),
+            "created_at": utc_now_iso(),
             "qr_code_url": request.qr_code_url
         }
         
-        response = supabase.table("payments").insert(payment_data).execute()
+        payment = await asyncio.to_thread(db.insert, "payments", payment_data)
         
-        return response.data
+        return [payment]
     
     except Exception as e:
         print(f"Error generating payment: {e}")
@@ -324,40 +592,56 @@ async def generate_payment(
 @app.post("/create-booking")
 async def create_booking(
     request: CreateBookingRequest,
+    http_request: Request,
 ):
     """Create a new booking"""
-    try:
-        booking_id = f"booking_{int(datetime.now().timestamp())}_{uuid.uuid4().hex[:9]}"
-        booking_data = {
-            "booking_id": booking_id,
-            "user_id": request.user_id,
-            "display_name": request.display_name,
-            "selected_date": request.selected_date,
-            "amount": request.amount,
-            "status": request.status,
-        }
-        response = supabase.table("bookings").insert(booking_data).execute()
-        
-        # Return response in camelCase format
-        return response.data[0]
+    await rate_limiter.check("create_booking", http_request, user_id=request.user_id)
+    
+    # A date known to be taken is refused from memory, before it can use a concurrency slot
+    if date_reservations.is_known_taken(request.selected_date):
+        raise HTTPException(
+            status_code=409, 
+            detail="Booking already exists for this date. Please choose a different date."
+        )
+    
+    booking_id = f"booking_{int(datetime.now().timestamp())}_{uuid.uuid4().hex[:9]}"
+    booking_data = {
+        "booking_id": booking_id,
+        "user_id": request.user_id,
+        "display_name": request.display_name,
+        "selected_date": request.selected_date,
+        "amount": request.amount,
+        "status": request.status,
+    }
+    
+    async def insert_if_absent():
+        # Only the request holding the date's lock counts against the cap; the
+        # ones queued behind it for the same date get their 409 from memory
+        async with booking_concurrency:
+            return await asyncio.to_thread(db.insert_if_absent, "bookings", booking_data, "selected_date")
     
+    try:
+        # Atomic claim of selected_date: INSERT ... ON CONFLICT (selected_date) DO NOTHING
+        booking = await date_reservations.claim(request.selected_date, insert_if_absent)
+    except HTTPException:
+        raise
     except Exception as e:
-        error_msg = str(e)
-        print(f"Error creating booking: {error_msg}")
-        
-        if "duplicate key value violates unique constraint" in error_msg:
-            raise HTTPException(
-                status_code=409, 
-                detail="Booking already exists for this date. Please choose a different date."
-            )
-        else:
-            raise HTTPException(status_code=500, detail=error_msg)
+        logger.error(f"Error creating booking: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+    
+    if booking is None:
+        raise HTTPException(
+            status_code=409, 
+            detail="Booking already exists for this date. Please choose a different date."
+        )
+    
+    return booking
 
 @app.get("/bookings", response_model=List[Booking])
 async def get_bookings():
     try:
-        result = supabase.table("bookings").select("*").execute()
-        return result.data
+        rows = await asyncio.to_thread(db.select, "bookings", BOOKING_LIST_COLUMNS)
+        return list_response(rows, booking_list_adapter)
     except Exception as e:
         print(f"Error getting bookings: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -366,8 +650,8 @@ async def get_bookings():
 async def get_user_bookings(user_id: str):
     """Get bookings for a specific user by user_id"""
     try:
-        result = supabase.table("bookings").select("*").eq("user_id", user_id).execute()
-        return result.data
+        rows = await asyncio.to_thread(db.select, "bookings", BOOKING_LIST_COLUMNS, {"user_id": user_id})
+        return list_response(rows, booking_list_adapter)
     except Exception as e:
         print(f"Error getting user bookings: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -376,8 +660,8 @@ async def get_user_bookings(user_id: str):
 async def get_user_pending_bookings(user_id: str):
     """Get pending bookings for a specific user by user_id"""
     try:
-        result = supabase.table("bookings").select("*").eq("user_id", user_id).eq("status", "pending").execute()
-        return result.data
+        rows = await asyncio.to_thread(db.select, "bookings", BOOKING_LIST_COLUMNS, {"user_id": user_id, "status": "pending"})
+        return list_response(rows, booking_list_adapter)
     except Exception as e:
         print(f"Error getting user pending bookings: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -386,8 +670,8 @@ async def get_user_pending_bookings(user_id: str):
 async def get_user_confirmed_bookings(user_id: str):
     """Get confirmed bookings for a specific user by user_id"""
     try:
-        result = supabase.table("bookings").select("*").eq("user_id", user_id).eq("status", "confirmed").execute()
-        return result.data
+        rows = await asyncio.to_thread(db.select, "bookings", BOOKING_LIST_COLUMNS, {"user_id": user_id, "status": "confirmed"})
+        return list_response(rows, booking_list_adapter)
     except Exception as e:
         print(f"Error getting user confirmed bookings: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -395,25 +679,62 @@ async def get_user_confirmed_bookings(user_id: str):
 @app.get("/payments", response_model=List[Payment])
 async def get_payments():
     try:
-        result = supabase.table("payments").select("*").execute()
-        return result.data
+        rows = await asyncio.to_thread(db.select, "payments", PAYMENT_LIST_COLUMNS)
+        return list_response(rows, payment_list_adapter)
     except Exception as e:
         print(f"Error getting payments: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.get("/payments/{payment_id}/raw")
+async def get_payment_raw(payment_id: str):
+    """Get the raw EasySlip response stored for a payment"""
+    try:
+        if PAYMENT_METADATA_MODE == "compact":
+            rows = await asyncio.to_thread(db.select, "payment_slip_raw", "easyslip_response", {"payment_id": payment_id})
+            if rows:
+                return rows[0]["easyslip_response"]
+        
+        # Legacy rows (or rows not yet migrated) still carry it in payments.metadata
+        payment_rows = await asyncio.to_thread(db.select, "payments", "metadata", {"payment_id": payment_id})
+        if not payment_rows:
+            raise HTTPException(status_code=404, detail="Payment not found")
+        
+        metadata = payment_rows[0].get("metadata") or {}
+        if "easyslip_data" in metadata:
+            return {"status": 200, "data": metadata["easyslip_data"], "message": None}
+        if metadata:
+            return metadata
+        raise HTTPException(status_code=404, detail="No EasySlip data stored for this payment")
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error getting raw payment data: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @app.post("/verify-slip", response_model=EasySlipResponse)
-async def verify_slip(slip_image: UploadFile = File(...)):
+async def verify_slip(request: Request, slip_image: UploadFile = File(...)):
     """Verify slip using EasySlip API"""
+    # No user_id on this endpoint, so only the per-IP verify_slip limit applies; shares the verify cap
+    await rate_limiter.check("verify_slip", request)
+    async with verify_concurrency:
+        return await _verify_slip(slip_image)
+
+async def _verify_slip(slip_image: UploadFile):
     try:
         # Validate file type
         if not slip_image.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # Read file content
-        file_content = await slip_image.read()
+        # Read file content, check the real format and shrink it if enabled
+        slip = await slip_preprocessor.prepare(await slip_image.read(), slip_image.filename)
+        if slip is None:
+            raise HTTPException(status_code=400, detail="File must be a JPEG, PNG, GIF or WebP image")
         
-        # Call EasySlip API
-        result = await verify_slip_with_easyslip(file_content, slip_image.filename)
+        # Reject unreadable / duplicate slips locally, otherwise call EasySlip API
+        result = await precheck_slip(slip.content)
+        if result is None:
+            result = await verify_slip_with_easyslip(slip.content, slip.filename, slip.content_type)
         
         return result
         
@@ -425,6 +746,7 @@ async def verify_slip(slip_image: UploadFile = File(...)):
 
 @app.post("/verify-slip-with-validation")
 async def verify_slip_with_validation(
+    request: Request,
     payment_id: str = Form(...),
     user_id: str = Form(...),
     display_name: str = Form(...),
@@ -433,23 +755,43 @@ async def verify_slip_with_validation(
     slip_image: UploadFile = File(...)
 ):
     """Verify slip with business validation rules and insert new record"""
+    await rate_limiter.check("verify_slip", request, user_id=user_id)
+    async with verify_concurrency:
+        return await _verify_slip_with_validation(
+            payment_id, user_id, display_name, selected_date, amount, slip_image
+        )
+
+async def _verify_slip_with_validation(
+    payment_id: str,
+    user_id: str,
+    display_name: str,
+    selected_date: str,
+    amount: float,
+    slip_image: UploadFile
+):
     try:
         # 1. Validate file type
         if not slip_image.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # 2. Read file content and call EasySlip API
-        file_content = await slip_image.read()
-        easyslip_result = await verify_slip_with_easyslip(file_content, slip_image.filename)
+        # 2. Read file content, check the real format and shrink it if enabled
+        slip = await slip_preprocessor.prepare(await slip_image.read(), slip_image.filename)
+        if slip is None:
+            raise HTTPException(status_code=400, detail="File must be a JPEG, PNG, GIF or WebP image")
+        
+        # 3. Reject unreadable / duplicate slips locally, otherwise call EasySlip API
+        easyslip_result = await precheck_slip(slip.content)
+        if easyslip_result is None:
+            easyslip_result = await verify_slip_with_easyslip(slip.content, slip.filename, slip.content_type)
         
-        # 3. Upload slip image to Supabase Storage
+        # 4. Upload slip image to Supabase Storage
         slip_url = await upload_file_to_supabase_storage(
-            file_content=file_content,
-            filename=slip_image.filename,
-            content_type=slip_image.content_type
+            file_content=slip.content,
+            filename=slip.filename,
+            content_type=slip.content_type
         )
         
-        # 3. Check if EasySlip API was successful
+        # 5. Check if EasySlip API was successful
         if easyslip_result.status != 200:
             # Insert record with error
             payment_data = {
@@ -461,11 +803,13 @@ async def verify_slip_with_validation(
                 "status": "failed",
                 "status_code": str(easyslip_result.status),
                 "response": easyslip_result.message,
-                "metadata": easyslip_result.model_dump(),
                 "slip_url": slip_url
             }
+            if PAYMENT_METADATA_MODE != "compact":
+                payment_data["metadata"] = easyslip_result.model_dump()
             
-            supabase.table("payments").insert(payment_data).execute()
+            await asyncio.to_thread(db.insert, "payments", payment_data)
+            await asyncio.to_thread(save_raw_easyslip_result, payment_id, easyslip_result)
             
             return {
                 "success": False,
@@ -473,48 +817,21 @@ async def verify_slip_with_validation(
                 "status_code": easyslip_result.status
             }
         
-        # 4. Validate business rules
-        validation_errors = []
+        # 6. Validate business rules
+        validation_errors = validate_slip_data(easyslip_result.data, amount)
         
-        # Check 2: Date within 10 minutes of current time
-        # ใช้เวลาปัจจุบันใน timezone ไทย
-        thailand_tz = timezone(timedelta(hours=7))
-        current_time = datetime.now(thailand_tz)  # เวลาปัจจุบันใน timezone ไทย
-        slip_date = datetime.fromisoformat(easyslip_result.data.date)  # +07:00
-        time_diff = abs((slip_date - current_time).total_seconds() / 60)
-        
-        if time_diff > time_diff_limit:
-            validation_errors.append(f"Payment time difference is {time_diff:.1f} minutes, must be within 10 minutes")
-        
-        if easyslip_result.data.amount.amount != amount:
-            validation_errors.append(f"Amount is {easyslip_result.data.amount.amount}, must be {amount}")
-        
-        receiver_name_th = easyslip_result.data.receiver.account.name.th
-        if receiver_name_th != receiver_name:
-            validation_errors.append(f"Receiver name is '{receiver_name_th}', must be '{receiver_name}'")
-        
-        # 5. Prepare payment data for insert
+        # 7. Prepare payment data for insert
         payment_data = {
             "payment_id": payment_id,
             "user_id": user_id,
             "display_name": display_name,
             "selected_date": selected_date,
             "amount": amount,
-            "tran_ref": easyslip_result.data.transRef,
             "slip_url": slip_url,
-            "metadata": {
-                "easyslip_data": easyslip_result.data.model_dump(),
-                "sender_bank": easyslip_result.data.sender.bank.name,
-                "sender_name": easyslip_result.data.sender.account.name.th,
-                "receiver_name": easyslip_result.data.receiver.account.name.th,
-                "transaction_date": easyslip_result.data.date,
-                "country_code": easyslip_result.data.countryCode,
-                "fee": easyslip_result.data.fee,
-                "payload": easyslip_result.data.payload
-            }
+            **build_slip_payment_data(easyslip_result.data)
         }
         
-        # 6. Determine result and insert into database
+        # 8. Determine result and insert into database
         if validation_errors:
             # Validation failed
             payment_data.update({
@@ -523,7 +840,8 @@ async def verify_slip_with_validation(
                 "response": "; ".join(validation_errors)
             })
             
-            supabase.table("payments").insert(payment_data).execute()
+            await asyncio.to_thread(db.insert, "payments", payment_data)
+            await asyncio.to_thread(save_raw_easyslip_result, payment_id, easyslip_result)
             
             return {
                 "success": False,
@@ -541,7 +859,9 @@ async def verify_slip_with_validation(
                 "paid_at": easyslip_result.data.date
             })
             
-            supabase.table("payments").insert(payment_data).execute()
+            await asyncio.to_thread(db.insert, "payments", payment_data)
+            await asyncio.to_thread(save_raw_easyslip_result, payment_id, easyslip_result)
+            verified_trans_refs.add(easyslip_result.data.transRef)
             
             return {
                 "success": True,
@@ -568,12 +888,6 @@ async def update_booking(
 ):
     """Update a booking by booking_id"""
     try:
-        # Check if booking exists
-        booking_result = supabase.table("bookings").select("*").eq("booking_id", booking_id).execute()
-        
-        if not booking_result.data:
-            raise HTTPException(status_code=404, detail="Booking not found")
-        
         # Prepare update data - only include fields that are provided
         update_data = {}
         
@@ -592,10 +906,22 @@ async def update_booking(
         
         # Check if there's any data to update
         if not update_data:
+            if not await asyncio.to_thread(db.select, "bookings", "booking_id", {"booking_id": booking_id}):
+                raise HTTPException(status_code=404, detail="Booking not found")
             raise HTTPException(status_code=400, detail="No data provided for update")
         
-        # Update the booking
-        supabase.table("bookings").update(update_data).eq("booking_id", booking_id).execute()
+        # Moving a booking frees its old date
+        previous_date = None
+        if selected_date is not None:
+            previous_rows = await asyncio.to_thread(db.select, "bookings", "selected_date", {"booking_id": booking_id})
+            previous_date = previous_rows[0]["selected_date"] if previous_rows else None
+        
+        # Update the booking; no updated rows means it does not exist
+        if not await asyncio.to_thread(db.update, "bookings", update_data, {"booking_id": booking_id}):
+            raise HTTPException(status_code=404, detail="Booking not found")
+        
+        if previous_date != selected_date:
+            date_reservations.release(previous_date)
         
         return {
             "success": True,
@@ -614,14 +940,11 @@ async def update_booking(
 async def delete_booking(booking_id: str):
     """Delete a booking by booking_id"""
     try:
-        # Check if booking exists
-        booking_result = supabase.table("bookings").select("*").eq("booking_id", booking_id).execute()
-        
-        if not booking_result.data:
+        # Delete the booking; no deleted rows means it does not exist
+        deleted = await asyncio.to_thread(db.delete, "bookings", {"booking_id": booking_id})
+        if not deleted:
             raise HTTPException(status_code=404, detail="Booking not found")
-        
-        # Delete the booking
-        supabase.table("bookings").delete().eq("booking_id", booking_id).execute()
+        date_reservations.release(deleted[0].get("selected_date"))
         
         return {
             "success": True,
@@ -636,14 +959,52 @@ async def delete_booking(booking_id: str):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.get("/health")
+@app.get("/health/live")
 async def health_check():
-    """Health check endpoint"""
+    """Liveness check: the process is up and serving requests; never touches dependencies"""
     return {
         "status": "OK",
         "timestamp": datetime.now().isoformat(),
         "service": "Clip Booking API"
     }
 
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness check from cached background probes; 503 while a required dependency is down"""
+    report = health_monitor.readiness()
+    ready = report["ready"]
+    # Scheduler state is informational: /cleanup/stop must not take the instance out of rotation
+    return ORJSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not_ready",
+            "reasons": report["reasons"],
+            "checks": report["checks"],
+            "event_loop_lag": report["event_loop_lag"],
+            "scheduler": {
+                "running": scheduler.running,
+                "cron_enabled": CRON_ENABLED,
+                "jobs": len(scheduler.get_jobs()),
+            },
+            "timestamp": datetime.now().isoformat(),
+            "service": "Clip Booking API"
+        }
+    )
+
+if LOOP_MONITOR_DEBUG_ENDPOINT:
+    @app.get("/debug/event-loop")
+    async def get_event_loop_report():
+        """Event loop lag and the most recent calls that blocked the loop, with stack traces"""
+        return {
+            **loop_monitor.report(),
+            "timestamp": datetime.now().isoformat()
+        }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Event loop metrics in Prometheus text format"""
+    return Response(content=loop_monitor.prometheus_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.post("/cleanup/old-bookings")
 async def manual_cleanup_old_bookings():
     """Manually trigger cleanup of old bookings"""
@@ -0,0 +1,66 @@
+-- Compact payment metadata
+--
+-- Promotes the frequently queried EasySlip fields out of payments.metadata
+-- into columns and moves the full EasySlip response into payment_slip_raw,
+-- which is only read by GET /payments/{payment_id}/raw.
+--
+-- Rollout:
+--   1. Run step 1 (schema) while the API still runs with PAYMENT_METADATA_MODE=legacy
+--   2. Deploy with PAYMENT_METADATA_MODE=compact
+--   3. Run step 2 (backfill) to migrate the rows written before the switch
+--   4. Run step 3 once GET /payments/{payment_id}/raw has been checked on a few old rows
+--
+-- Measure row size before step 1 and after step 3:
+--   SELECT count(*), avg(pg_column_size(p.*))::int AS avg_row_bytes,
+--          pg_size_pretty(pg_total_relation_size('payments')) AS table_size
+--   FROM payments p;
+
+-- Step 1: schema
+ALTER TABLE payments
+    ADD COLUMN IF NOT EXISTS sender_bank VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS sender_name VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS receiver_name VARCHAR(255),
+    ADD COLUMN IF NOT EXISTS transaction_date TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS fee DECIMAL(10,2),
+    ADD COLUMN IF NOT EXISTS payload TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_payments_tran_ref ON payments (tran_ref);
+
+CREATE TABLE IF NOT EXISTS payment_slip_raw (
+    payment_id VARCHAR(255) PRIMARY KEY REFERENCES payments(payment_id) ON DELETE CASCADE,
+    easyslip_response JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+-- EasySlip responses are ~1-2 KB, below the default TOAST threshold, so lower
+-- the target to get them compressed; lz4 needs PostgreSQL 14+
+ALTER TABLE payment_slip_raw SET (toast_tuple_target = 128);
+ALTER TABLE payment_slip_raw ALTER COLUMN easyslip_response SET COMPRESSION lz4;
+
+-- Step 2: backfill rows written in legacy mode
+INSERT INTO payment_slip_raw (payment_id, easyslip_response)
+SELECT payment_id,
+       CASE WHEN metadata::jsonb ? 'easyslip_data'
+            THEN jsonb_build_object('status', 200, 'data', metadata->'easyslip_data', 'message', NULL)
+            ELSE metadata::jsonb
+       END
+FROM payments
+WHERE metadata IS NOT NULL
+ON CONFLICT (payment_id) DO NOTHING;
+
+UPDATE payments
+SET sender_bank = metadata->>'sender_bank',
+    sender_name = metadata->>'sender_name',
+    receiver_name = metadata->>'receiver_name',
+    transaction_date = (metadata->>'transaction_date')::timestamptz,
+    fee = (metadata->>'fee')::decimal,
+    payload = metadata->>'payload'
+WHERE metadata::jsonb ? 'easyslip_data';
+
+-- Step 3: drop the duplicated data from the payments rows
+UPDATE payments SET metadata = NULL
+WHERE metadata IS NOT NULL
+  AND payment_id IN (SELECT payment_id FROM payment_slip_raw);
+
+-- Then, outside a transaction, reclaim the space (VACUUM FULL locks the table):
+--   VACUUM (FULL, ANALYZE) payments;
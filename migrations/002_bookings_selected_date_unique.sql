@@ -0,0 +1,20 @@
+-- One booking per date
+--
+-- POST /create-booking claims a date with
+--   INSERT ... ON CONFLICT (selected_date) DO NOTHING
+-- (PostgREST upsert with on_conflict=selected_date). PostgreSQL only accepts
+-- that when a non-partial UNIQUE constraint covers exactly bookings(selected_date);
+-- without it every booking insert fails with 42P10 and the endpoint returns 500.
+--
+-- Rollout: run this before deploying the version that claims dates atomically.
+
+-- Step 1: the constraint can't be added while a date is booked twice; list them first
+SELECT selected_date, count(*) AS bookings, array_agg(booking_id ORDER BY id) AS booking_ids
+FROM bookings
+GROUP BY selected_date
+HAVING count(*) > 1;
+
+-- Resolve those rows by hand (keep the paid/confirmed booking), then:
+
+-- Step 2: constraint
+ALTER TABLE bookings ADD CONSTRAINT bookings_selected_date_key UNIQUE (selected_date);
@@ -0,0 +1,13 @@
+-- Index for the duplicate slip lookup
+--
+-- With SLIP_QR_PRECHECK_ENABLED=true, POST /verify-slip looks up
+--   SELECT payment_id FROM payments WHERE tran_ref = ? AND status = 'success' LIMIT 1
+-- for every slip before calling EasySlip. Without an index that is a full
+-- scan of payments on every upload.
+--
+-- 001_compact_payment_metadata.sql creates the same index; this file is for
+-- databases that enable the precheck but still run PAYMENT_METADATA_MODE=legacy.
+-- CONCURRENTLY does not lock writes but can't run inside a transaction, so run
+-- it on its own (not in the Supabase SQL editor's multi-statement mode).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_tran_ref ON payments (tran_ref);
@@ -0,0 +1,41 @@
+"""
+Lazily started process pool for CPU-bound slip work (image re-encoding, QR decoding).
+
+The API process already runs threads (the loop monitor's watchdog,
+asyncio.to_thread workers, the SQLite lock holder), and forking a threaded
+process can leave locks held forever in the child. Workers are therefore
+started with "forkserver", which forks from a clean single-threaded server
+process, or "spawn" where forkserver is not available (Windows).
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+
+
+def _mp_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class LazyProcessPool:
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def get(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_mp_context())
+        return self._pool
+
+    async def run(self, fn: Callable, *args):
+        """Run a module-level function in the pool; `fn` and `args` must be picklable"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.get(), fn, *args)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
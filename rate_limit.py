@@ -0,0 +1,220 @@
+"""
+Rate limiting and admission control for expensive endpoints.
+
+Token buckets are keyed per endpoint and per client (user_id / IP). The
+bucket state lives in a pluggable backend: the in-memory backend is enough
+for a single uvicorn worker, the Redis backend shares state between workers.
+
+IP buckets have their own, looser limits: many users can share one address
+(carrier NAT, an office), and behind a proxy without RATE_LIMIT_TRUST_PROXY
+every request comes from the proxy's address.
+"""
+
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RateLimit:
+    """Token bucket settings: `burst` tokens, refilled at `per_minute` tokens/min"""
+    per_minute: float
+    burst: int
+
+    @property
+    def refill_per_second(self) -> float:
+        return self.per_minute / 60.0
+
+
+class InMemoryRateLimitBackend:
+    """Process-local token buckets (one dict, safe because the event loop is single-threaded)"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    async def acquire(self, key: str, limit: RateLimit, cost: int = 1) -> float:
+        """Take `cost` tokens; return 0 if allowed, otherwise seconds until retry"""
+        return await self.acquire_all([(key, limit)], cost)
+
+    async def acquire_all(self, buckets: List[Tuple[str, RateLimit]], cost: int = 1) -> float:
+        """Take `cost` tokens from every bucket, or from none if any of them is short"""
+        now = time.monotonic()
+        refilled = []
+        retry_after = 0.0
+        for key, limit in buckets:
+            tokens, updated_at = self._buckets.get(key, (float(limit.burst), now))
+            tokens = min(float(limit.burst), tokens + (now - updated_at) * limit.refill_per_second)
+            refilled.append(tokens)
+            if tokens < cost:
+                wait = (cost - tokens) / limit.refill_per_second if limit.refill_per_second > 0 else 60.0
+                retry_after = max(retry_after, wait)
+
+        for (key, limit), tokens in zip(buckets, refilled):
+            self._buckets[key] = (tokens if retry_after > 0 else tokens - cost, now)
+        if len(self._buckets) > self.max_keys:
+            self._prune(now, buckets[0][1])
+        return retry_after
+
+    def _prune(self, now: float, limit: RateLimit):
+        """Drop buckets that have been idle long enough to be full again"""
+        idle_seconds = limit.burst / limit.refill_per_second if limit.refill_per_second > 0 else 3600
+        stale = [key for key, (_, updated_at) in self._buckets.items() if now - updated_at >= idle_seconds]
+        for key in stale:
+            del self._buckets[key]
+
+
+class RedisRateLimitBackend:
+    """Token buckets shared between workers through Redis (requires the `redis` package)"""
+
+    # KEYS = bucket keys; ARGV = now, cost, then burst and refill/s for each key.
+    # All buckets are checked before any is charged, atomically.
+    _SCRIPT = """
+local now = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local refilled = {}
+local retry_after = 0
+for i, key in ipairs(KEYS) do
+    local burst = tonumber(ARGV[1 + i * 2])
+    local rate = tonumber(ARGV[2 + i * 2])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    refilled[i] = tokens
+    if tokens < cost then
+        local wait = 60
+        if rate > 0 then
+            wait = (cost - tokens) / rate
+        end
+        retry_after = math.max(retry_after, wait)
+    end
+end
+for i, key in ipairs(KEYS) do
+    local burst = tonumber(ARGV[1 + i * 2])
+    local rate = tonumber(ARGV[2 + i * 2])
+    local tokens = refilled[i]
+    if retry_after == 0 then
+        tokens = tokens - cost
+    end
+    redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+    if rate > 0 then
+        redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+    end
+end
+return tostring(retry_after)
+"""
+
+    def __init__(self, redis_url: str, prefix: str = "ratelimit:"):
+        import redis.asyncio as redis_asyncio
+
+        self.prefix = prefix
+        self._redis = redis_asyncio.from_url(redis_url)
+        self._script = self._redis.register_script(self._SCRIPT)
+
+    async def acquire(self, key: str, limit: RateLimit, cost: int = 1) -> float:
+        """Take `cost` tokens; return 0 if allowed, otherwise seconds until retry"""
+        return await self.acquire_all([(key, limit)], cost)
+
+    async def acquire_all(self, buckets: List[Tuple[str, RateLimit]], cost: int = 1) -> float:
+        """Take `cost` tokens from every bucket, or from none if any of them is short"""
+        args = [time.time(), cost]
+        for _, limit in buckets:
+            args += [limit.burst, limit.refill_per_second]
+        result = await self._script(keys=[self.prefix + key for key, _ in buckets], args=args)
+        return float(result)
+
+
+class RateLimiter:
+    """Per-endpoint token-bucket limits keyed by user_id (`limits`) and client IP (`ip_limits`)"""
+
+    def __init__(self, backend, limits: Dict[str, RateLimit], ip_limits: Optional[Dict[str, RateLimit]] = None,
+                 enabled: bool = True, trust_proxy: bool = False):
+        self.backend = backend
+        self.limits = limits
+        self.ip_limits = ip_limits or {}
+        self.enabled = enabled
+        self.trust_proxy = trust_proxy
+
+    def client_ip(self, request: Request) -> str:
+        """Client IP, taken from X-Forwarded-For only when running behind a trusted proxy"""
+        if self.trust_proxy:
+            forwarded_for = request.headers.get("x-forwarded-for")
+            if forwarded_for:
+                return forwarded_for.split(",")[0].strip()
+        return request.client.host if request.client else "unknown"
+
+    async def check(self, endpoint: str, request: Request, user_id: Optional[str] = None):
+        """Raise 429 with Retry-After if the user or the IP is over the endpoint's limit"""
+        if not self.enabled:
+            return
+
+        buckets = []
+        ip_limit = self.ip_limits.get(endpoint)
+        if ip_limit is not None:
+            buckets.append((f"{endpoint}:ip:{self.client_ip(request)}", ip_limit))
+        user_limit = self.limits.get(endpoint)
+        if user_id and user_limit is not None:
+            buckets.append((f"{endpoint}:user:{user_id}", user_limit))
+        if not buckets:
+            return
+
+        try:
+            # A request refused by one bucket is not charged to the others
+            retry_after = await self.backend.acquire_all(buckets)
+        except Exception as e:
+            # Fail open: a broken limiter backend must not take the API down with it
+            logger.error(f"Rate limiter backend error on {endpoint}: {e}")
+            return
+
+        if retry_after > 0:
+            logger.warning(f"Rate limit exceeded on {endpoint} (user={user_id}, ip={self.client_ip(request)})")
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests. Please try again later.",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+
+
+class ConcurrencyLimiter:
+    """Global in-flight cap for one route; sheds load with 503 instead of queueing"""
+
+    def __init__(self, name: str, max_concurrency: int, retry_after: int = 1):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.in_flight = 0
+
+    async def __aenter__(self):
+        if self.max_concurrency > 0 and self.in_flight >= self.max_concurrency:
+            logger.warning(f"Shedding load on {self.name}: {self.in_flight} requests in flight")
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy. Please try again shortly.",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        return False
+
+
+def create_rate_limit_backend(backend_name: str, redis_url: Optional[str] = None):
+    """Build the configured backend, falling back to in-memory if Redis is unusable"""
+    if backend_name == "redis":
+        if not redis_url:
+            logger.error("RATE_LIMIT_BACKEND=redis but REDIS_URL is not set, using in-memory backend")
+        else:
+            try:
+                return RedisRateLimitBackend(redis_url)
+            except ImportError:
+                logger.error("redis package not installed, using in-memory rate limit backend")
+    return InMemoryRateLimitBackend()
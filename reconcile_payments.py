@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Offline payment reconciliation
+
+Re-verifies historical `payments` rows (e.g. rows stuck with status_code 500
+after an EasySlip outage) using the slip stored in Supabase Storage, and
+writes the new status back in bulk. Uses the same EasySlip client and
+validation rules as /verify-slip-with-validation; the time-difference rule is
+checked against the row's created_at instead of the current time.
+
+Rows are read in pages ordered by `id`, and the last finished id is written
+to a checkpoint file after every page so an interrupted run can continue
+with --resume.
+
+Usage:
+    python reconcile_payments.py --status-code 500
+    python reconcile_payments.py --status failed --since 2025-07-01 --dry-run
+    python reconcile_payments.py --status-code 500 --resume
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+import httpx
+
+from main import (
+    EasySlipResponse,
+    PAYMENT_METADATA_MODE,
+    REDIS_URL,
+    RATE_LIMIT_BACKEND,
+    build_slip_payment_data,
+    db,
+    validate_slip_data,
+    verify_slip_with_easyslip,
+)
+from rate_limit import RateLimit, create_rate_limit_backend
+from slip_image import detect_image_type
+
+logger = logging.getLogger("reconcile_payments")
+
+
+def load_checkpoint(path: str) -> int:
+    """Last reconciled payments.id, or 0 when starting fresh"""
+    try:
+        with open(path) as f:
+            return int(json.load(f).get("last_id", 0))
+    except FileNotFoundError:
+        return 0
+
+
+def save_checkpoint(path: str, last_id: int, stats: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"last_id": last_id, "stats": stats, "updated_at": datetime.now().isoformat()}, f)
+    os.replace(tmp_path, path)
+
+
+def parse_created_at(value: Optional[str]) -> Optional[datetime]:
+    """created_at as an aware datetime; naive database timestamps are UTC"""
+    if not value:
+        return None
+    created_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at
+
+
+class Reconciler:
+    def __init__(self, args):
+        self.args = args
+        self.rate_limit = RateLimit(per_minute=args.rate_per_minute, burst=max(1, args.concurrency))
+        # With RATE_LIMIT_BACKEND=redis the bucket is shared by all reconciliation runs; it is separate
+        # from the API's per-user/IP buckets, so keep --rate-per-minute below the quota left by live traffic
+        self.rate_backend = create_rate_limit_backend(RATE_LIMIT_BACKEND, REDIS_URL)
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+        # tran_refs marked success during this run; rows of a page are only written after the whole page
+        self.claimed_trans_refs = set()
+        self.stats = {"scanned": 0, "updated": 0, "success": 0, "failed": 0, "unchanged": 0, "skipped": 0}
+
+    def fetch_page(self, after_id: int) -> List[dict]:
+        filters = {"id__gt": after_id}
+        if self.args.status:
+            filters["status"] = self.args.status
+        if self.args.status_code:
+            filters["status_code__in"] = self.args.status_code
+        if self.args.since:
+            filters["created_at__gte"] = self.args.since
+        if self.args.until:
+            filters["created_at__lte"] = self.args.until
+        return db.select("payments", filters=filters, order_by="id", limit=self.args.page_size)
+
+    def is_duplicate(self, tran_ref: str, payment_id: str) -> bool:
+        rows = db.select("payments", "payment_id", {"tran_ref": tran_ref, "status": "success", "payment_id__neq": payment_id}, limit=1)
+        return bool(rows)
+
+    async def claim_trans_ref(self, tran_ref: str, payment_id: str) -> bool:
+        """Reserve a slip for this payment; False if another payment already used it"""
+        # Check and add with no await in between, so concurrent rows of a page can't both claim it
+        if tran_ref in self.claimed_trans_refs:
+            return False
+        self.claimed_trans_refs.add(tran_ref)
+        try:
+            duplicate = await asyncio.to_thread(self.is_duplicate, tran_ref, payment_id)
+        except Exception:
+            self.claimed_trans_refs.discard(tran_ref)
+            raise
+        # On a duplicate the ref stays claimed: it belongs to the payment already in the database
+        return not duplicate
+
+    async def wait_for_token(self):
+        while True:
+            retry_after = await self.rate_backend.acquire("easyslip:reconcile", self.rate_limit)
+            if retry_after <= 0:
+                return
+            await asyncio.sleep(retry_after)
+
+    async def reverify(self, client: httpx.AsyncClient, row: dict) -> Optional[Tuple[dict, EasySlipResponse]]:
+        """New column values for a row plus the EasySlip response, or None to leave it unchanged"""
+        if not row.get("slip_url"):
+            self.stats["skipped"] += 1
+            return None
+
+        async with self.semaphore:
+            response = await client.get(row["slip_url"])
+            if response.status_code != 200:
+                logger.warning(f"{row['payment_id']}: could not download slip ({response.status_code})")
+                self.stats["skipped"] += 1
+                return None
+            content = response.content
+            detected = detect_image_type(content)
+            content_type = detected[0] if detected else "image/jpeg"
+            filename = row["slip_url"].rsplit("/", 1)[-1]
+
+            await self.wait_for_token()
+            # EasySlip has usually seen this slip before, so our own tran_ref check replaces checkDuplicate
+            easyslip_result: EasySlipResponse = await verify_slip_with_easyslip(
+                content, filename, content_type, check_duplicate=False
+            )
+
+        if easyslip_result.status != 200:
+            if str(easyslip_result.status) == row.get("status_code"):
+                self.stats["unchanged"] += 1
+                return None
+            updates = {
+                "status": "failed",
+                "status_code": str(easyslip_result.status),
+                "response": easyslip_result.message,
+            }
+            if PAYMENT_METADATA_MODE != "compact":
+                updates["metadata"] = easyslip_result.model_dump()
+            return updates, easyslip_result
+
+        data = easyslip_result.data
+        updates = build_slip_payment_data(data)
+        validation_errors = validate_slip_data(
+            data, float(row["amount"]), reference_time=parse_created_at(row.get("created_at"))
+        )
+        if not validation_errors and not await self.claim_trans_ref(data.transRef, row["payment_id"]):
+            validation_errors.append(f"Slip {data.transRef} is already used by another payment")
+
+        if validation_errors:
+            updates.update({"status": "failed", "status_code": "400", "response": "; ".join(validation_errors)})
+        else:
+            updates.update({
+                "status": "success",
+                "status_code": "200",
+                "response": "Payment verified successfully",
+                "paid_at": data.date,
+            })
+        return updates, easyslip_result
+
+    def write_updates(self, rows: List[dict], raw_rows: List[dict]):
+        # Upsert full rows so the insert half of ON CONFLICT satisfies NOT NULL columns
+        db.upsert("payments", rows, on_conflict="payment_id")
+        if raw_rows:
+            db.upsert("payment_slip_raw", raw_rows, on_conflict="payment_id")
+
+    async def run(self):
+        last_id = load_checkpoint(self.args.checkpoint) if self.args.resume else 0
+        if last_id:
+            logger.info(f"Resuming after payments.id {last_id}")
+
+        async with httpx.AsyncClient(timeout=30) as client:
+            while True:
+                rows = await asyncio.to_thread(self.fetch_page, last_id)
+                if not rows:
+                    break
+                if self.args.limit:
+                    rows = rows[:max(0, self.args.limit - self.stats["scanned"])]
+                    if not rows:
+                        break
+
+                results = await asyncio.gather(
+                    *(self.reverify(client, row) for row in rows), return_exceptions=True
+                )
+
+                changed = []
+                raw_rows = []
+                for row, result in zip(rows, results):
+                    if isinstance(result, Exception):
+                        logger.error(f"{row['payment_id']}: {result}")
+                        self.stats["skipped"] += 1
+                    elif result:
+                        updates, easyslip_result = result
+                        self.stats[updates["status"]] += 1
+                        logger.info(f"{row['payment_id']}: {row.get('status')}/{row.get('status_code')} -> {updates['status']}/{updates['status_code']}")
+                        changed.append({**row, **updates})
+                        if PAYMENT_METADATA_MODE == "compact":
+                            raw_rows.append({"payment_id": row["payment_id"], "easyslip_response": easyslip_result.model_dump()})
+
+                if changed and not self.args.dry_run:
+                    await asyncio.to_thread(self.write_updates, changed, raw_rows)
+                    self.stats["updated"] += len(changed)
+
+                self.stats["scanned"] += len(rows)
+                last_id = rows[-1]["id"]
+                if not self.args.dry_run:
+                    save_checkpoint(self.args.checkpoint, last_id, self.stats)
+                logger.info(f"Page done up to id {last_id}: {self.stats}")
+
+                if len(rows) < self.args.page_size or (self.args.limit and self.stats["scanned"] >= self.args.limit):
+                    break
+
+        logger.info(f"Reconciliation finished: {self.stats}")
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--status", help="only rows with this payments.status (e.g. failed)")
+    parser.add_argument("--status-code", action="append", help="only rows with this status_code; repeatable (e.g. 500)")
+    parser.add_argument("--since", help="created_at lower bound (ISO date/time)")
+    parser.add_argument("--until", help="created_at upper bound (ISO date/time)")
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many rows (0 = no limit)")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4, help="max EasySlip calls in flight")
+    parser.add_argument("--rate-per-minute", type=float, default=30, help="max EasySlip calls per minute")
+    parser.add_argument("--checkpoint", default=".reconcile_checkpoint.json")
+    parser.add_argument("--resume", action="store_true", help="continue after the id stored in --checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="re-verify and log, but do not write anything")
+    args = parser.parse_args()
+
+    if not args.status and not args.status_code:
+        parser.error("pass --status and/or --status-code to select the rows to reconcile")
+
+    asyncio.run(Reconciler(args).run())
+
+
+if __name__ == "__main__":
+    main()
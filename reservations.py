@@ -0,0 +1,80 @@
+"""
+In-process front for booking date reservations.
+
+The database stays the source of truth: a date is claimed with a single
+INSERT ... ON CONFLICT (selected_date) DO NOTHING (Storage.insert_if_absent).
+This class only keeps a rush of requests for one date from all reaching
+the database:
+
+- Requests for the same date queue on a per-date asyncio.Lock, so at most
+  one claim per date is in flight in this process.
+- Once a date is known to be taken, later requests are answered from memory
+  for `taken_ttl` seconds without a database round trip.
+
+The taken-cache is per process, so after a booking is deleted in another
+worker this process can keep refusing its date for up to `taken_ttl` seconds.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+
+class DateReservations:
+    def __init__(self, taken_ttl: float = 5.0, max_cached_dates: int = 10_000):
+        self.taken_ttl = taken_ttl
+        self.max_cached_dates = max_cached_dates
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+        self._taken_until: Dict[str, float] = {}
+
+    def is_known_taken(self, date: str) -> bool:
+        taken_until = self._taken_until.get(date)
+        if taken_until is None:
+            return False
+        if taken_until < time.monotonic():
+            del self._taken_until[date]
+            return False
+        return True
+
+    def mark_taken(self, date: str):
+        if self.taken_ttl <= 0:
+            return
+        now = time.monotonic()
+        self._taken_until[date] = now + self.taken_ttl
+        if len(self._taken_until) > self.max_cached_dates:
+            for cached_date in [d for d, until in self._taken_until.items() if until < now]:
+                del self._taken_until[cached_date]
+
+    def release(self, date: Optional[str]):
+        """Forget a date after its booking was deleted or moved"""
+        if date:
+            self._taken_until.pop(date, None)
+
+    async def claim(self, date: str, insert: Callable[[], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        """
+        Run `insert` for `date` unless the date is already taken.
+
+        `insert` must do the atomic insert-if-absent and return the new row,
+        or None if the database already had a booking for the date. Returns
+        the new row if this request claimed the date, otherwise None.
+        """
+        if self.is_known_taken(date):
+            return None
+
+        lock = self._locks.setdefault(date, asyncio.Lock())
+        self._lock_users[date] = self._lock_users.get(date, 0) + 1
+        try:
+            async with lock:
+                # Whoever held the lock before us may have just claimed it
+                if self.is_known_taken(date):
+                    return None
+                row = await insert()
+                # Claimed by us or by someone else: either way the date is taken now
+                self.mark_taken(date)
+                return row
+        finally:
+            self._lock_users[date] -= 1
+            if self._lock_users[date] == 0:
+                del self._lock_users[date]
+                del self._locks[date]
@@ -0,0 +1,143 @@
+"""
+Slip image preprocessing.
+
+Uploads are checked against their magic bytes (the client-supplied
+content type is not trusted), then optionally re-encoded in a process
+pool: EXIF is stripped, the image is downscaled so its longest side fits
+SLIP_MAX_DIMENSION, and JPEG quality is stepped down until the result is
+under SLIP_TARGET_BYTES. The QR code on a bank slip stays readable well
+below the resolution of a phone photo, so this mostly removes bytes that
+EasySlip and Supabase Storage never needed.
+"""
+
+import io
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from process_pool import LazyProcessPool
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is only needed when preprocessing is enabled
+    Image = None
+    ImageOps = None
+
+# (magic prefix, content type, file extension)
+_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png", "png"),
+    (b"GIF87a", "image/gif", "gif"),
+    (b"GIF89a", "image/gif", "gif"),
+]
+
+MIN_JPEG_QUALITY = 60
+
+
+@dataclass
+class PreparedSlip:
+    content: bytes
+    content_type: str
+    filename: str
+    original_size: int
+
+
+def detect_image_type(content: bytes) -> Optional[tuple]:
+    """Return (content_type, extension) from the file's magic bytes, or None if not a supported image"""
+    for magic, content_type, extension in _SIGNATURES:
+        if content.startswith(magic):
+            return content_type, extension
+    if len(content) >= 12 and content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp", "webp"
+    return None
+
+
+def _replace_extension(filename: str, extension: str) -> str:
+    base, _ = os.path.splitext(filename or "slip")
+    return f"{base}.{extension}"
+
+
+def compress_slip_image(content: bytes, max_dimension: int, jpeg_quality: int, target_bytes: int) -> Optional[bytes]:
+    """
+    Re-encode an image as an EXIF-free JPEG that fits the size budget.
+
+    Runs inside a worker process, so it only takes and returns plain bytes.
+    Returns None if the image cannot be decoded.
+    """
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+
+            if max(image.size) > max_dimension:
+                image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+            quality = jpeg_quality
+            while True:
+                output = io.BytesIO()
+                # No exif= argument, so metadata from the original is dropped
+                image.save(output, format="JPEG", quality=quality, optimize=True)
+                if output.tell() <= target_bytes or quality <= MIN_JPEG_QUALITY:
+                    return output.getvalue()
+                quality = max(MIN_JPEG_QUALITY, quality - 10)
+    except Exception:
+        return None
+
+
+class SlipImagePreprocessor:
+    """Validates slip uploads and, when enabled, shrinks them off the event loop"""
+
+    def __init__(self, enabled: bool, max_dimension: int = 1600, jpeg_quality: int = 85,
+                 target_bytes: int = 500_000, max_workers: int = 2):
+        if enabled and Image is None:
+            logger.error("SLIP_PREPROCESS_ENABLED=true but Pillow is not installed, preprocessing disabled")
+            enabled = False
+        self.enabled = enabled
+        self.max_dimension = max_dimension
+        self.jpeg_quality = jpeg_quality
+        self.target_bytes = target_bytes
+        self.max_workers = max_workers
+        self._pool = LazyProcessPool(max_workers)
+
+    def shutdown(self):
+        self._pool.shutdown()
+
+    async def prepare(self, content: bytes, filename: str) -> Optional[PreparedSlip]:
+        """Return the slip to send/store, or None if the bytes are not a supported image"""
+        detected = detect_image_type(content)
+        if detected is None:
+            return None
+        content_type, extension = detected
+        prepared = PreparedSlip(
+            content=content,
+            content_type=content_type,
+            filename=_replace_extension(filename, extension),
+            original_size=len(content),
+        )
+        if not self.enabled or content_type == "image/gif":
+            return prepared
+
+        try:
+            compressed = await self._pool.run(
+                compress_slip_image, content, self.max_dimension, self.jpeg_quality, self.target_bytes
+            )
+        except Exception as e:
+            logger.error(f"Slip preprocessing failed, using original upload: {e}")
+            return prepared
+
+        # Always prefer the re-encoded JPEG for JPEG input (it drops EXIF);
+        # for other formats only switch when it actually saves bytes
+        if compressed and (content_type == "image/jpeg" or len(compressed) < len(content)):
+            prepared.content = compressed
+            prepared.content_type = "image/jpeg"
+            prepared.filename = _replace_extension(filename, "jpg")
+        return prepared
@@ -0,0 +1,154 @@
+"""
+Local decoding of the mini-QR printed on Thai bank transfer slips.
+
+The slip QR carries the same string EasySlip returns as `data.payload`:
+EMV-style TLV fields (tag, 2-digit length, value) ending in a CRC16 (tag 91).
+
+    00  slip data     -> 00 API id, 01 sending bank code, 02 transaction ref
+    51  country code
+    91  CRC16-CCITT of everything up to and including "9104"
+
+Amount and receiver are not part of the payload, so those rules still need
+EasySlip; what can be checked locally is whether the image has a readable
+slip QR at all and whether its transaction ref was already used.
+"""
+
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from process_pool import LazyProcessPool
+
+logger = logging.getLogger(__name__)
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # opencv-python-headless is only needed when the precheck is enabled
+    cv2 = None
+    np = None
+
+
+@dataclass
+class SlipPayload:
+    payload: str
+    trans_ref: str
+    sending_bank: Optional[str] = None
+    country_code: Optional[str] = None
+
+
+def _parse_tlv(data: str) -> Optional[Dict[str, str]]:
+    fields = {}
+    position = 0
+    while position < len(data):
+        if position + 4 > len(data) or not data[position + 2:position + 4].isdigit():
+            return None
+        tag = data[position:position + 2]
+        length = int(data[position + 2:position + 4])
+        value = data[position + 4:position + 4 + length]
+        if len(value) != length:
+            return None
+        fields[tag] = value
+        position += 4 + length
+    return fields
+
+
+def _crc16_ccitt(data: str) -> str:
+    crc = 0xFFFF
+    for byte in data.encode("ascii", errors="replace"):
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+            crc &= 0xFFFF
+    return f"{crc:04X}"
+
+
+def parse_slip_payload(payload: str) -> Optional[SlipPayload]:
+    """Parse and checksum a slip QR payload; None if it is not a valid transfer slip QR"""
+    if not payload or len(payload) < 8 or payload[-8:-4] != "9104":
+        return None
+    if _crc16_ccitt(payload[:-4]) != payload[-4:].upper():
+        return None
+
+    fields = _parse_tlv(payload)
+    if not fields or "00" not in fields:
+        return None
+    slip_fields = _parse_tlv(fields["00"])
+    if not slip_fields or not slip_fields.get("02"):
+        return None
+
+    return SlipPayload(
+        payload=payload,
+        trans_ref=slip_fields["02"],
+        sending_bank=slip_fields.get("01"),
+        country_code=fields.get("51"),
+    )
+
+
+def decode_qr_payload(content: bytes) -> Optional[str]:
+    """
+    Decode the first QR code in an image.
+
+    Runs inside a worker process. Tries the Aruco-based detector when the
+    default one fails, and retries on a downscaled copy because both often
+    miss small codes in very large photos.
+    """
+    try:
+        image = cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            return None
+        candidates = [image]
+        longest_side = max(image.shape[:2])
+        if longest_side > 1000:
+            scale = 1000 / longest_side
+            candidates.append(cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA))
+
+        detectors = [cv2.QRCodeDetector()]
+        if hasattr(cv2, "QRCodeDetectorAruco"):
+            detectors.append(cv2.QRCodeDetectorAruco())
+
+        for candidate in candidates:
+            for detector in detectors:
+                payload, _, _ = detector.detectAndDecode(candidate)
+                if payload:
+                    return payload
+        return None
+    except Exception:
+        return None
+
+
+class RecentTransRefs:
+    """Bounded LRU of transaction refs already verified by this process"""
+
+    def __init__(self, max_size: int = 10_000):
+        self.max_size = max_size
+        self._refs: "OrderedDict[str, None]" = OrderedDict()
+
+    def add(self, trans_ref: str):
+        self._refs[trans_ref] = None
+        self._refs.move_to_end(trans_ref)
+        if len(self._refs) > self.max_size:
+            self._refs.popitem(last=False)
+
+    def __contains__(self, trans_ref: str) -> bool:
+        return trans_ref in self._refs
+
+
+class SlipQRDecoder:
+    """Decodes slip QR codes in a process pool so the event loop stays free"""
+
+    def __init__(self, enabled: bool, max_workers: int = 2):
+        if enabled and cv2 is None:
+            logger.error("SLIP_QR_PRECHECK_ENABLED=true but opencv-python-headless is not installed, precheck disabled")
+            enabled = False
+        self.enabled = enabled
+        self.max_workers = max_workers
+        self._pool = LazyProcessPool(max_workers)
+
+    def shutdown(self):
+        self._pool.shutdown()
+
+    async def decode(self, content: bytes) -> Optional[str]:
+        """Raw QR payload of the image, or None if no QR code could be read"""
+        return await self._pool.run(decode_qr_payload, content)
@@ -0,0 +1,365 @@
+"""
+Storage backends for bookings and payments.
+
+The endpoints only need a handful of operations, so the interface is small:
+insert, insert-if-absent (atomic claim), upsert, select, conditional
+update / delete and the expiry sweep.
+Filters are dicts of `column` (equality) or `column__op` with op one of
+neq, gt, gte, lt, lte, in, e.g. {"user_id": user_id, "created_at__lt": cutoff}.
+
+    SupabaseStorage  the hosted Supabase/PostgREST tables (default)
+    SQLiteStorage    a local SQLite file in WAL mode, for co-located
+                     deployments, tests and benchmarks
+
+Select the backend with STORAGE_BACKEND=supabase|sqlite (see create_storage).
+
+Timestamps such as created_at are naive UTC ISO strings on both backends, the
+same as the Postgres `TIMESTAMP DEFAULT NOW()` columns return.
+"""
+
+import json
+import logging
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_OPERATORS = {"eq", "neq", "gt", "gte", "lt", "lte", "in"}
+
+
+class DuplicateKeyError(Exception):
+    """A row with the same unique key already exists"""
+
+
+def to_utc_iso(value: datetime) -> str:
+    """Naive UTC ISO string; naive input is taken to be UTC already"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat()
+
+
+def utc_now_iso() -> str:
+    return to_utc_iso(datetime.now(timezone.utc))
+
+
+def _split_filter(key: str) -> Tuple[str, str]:
+    column, _, op = key.partition("__")
+    op = op or "eq"
+    if op not in _OPERATORS:
+        raise ValueError(f"Unsupported filter operator: {key}")
+    return column, op
+
+
+class Storage(ABC):
+    """Interface shared by the storage backends"""
+
+    @abstractmethod
+    def insert(self, table: str, row: dict) -> dict:
+        """Insert one row and return it as stored; raises DuplicateKeyError on a unique conflict"""
+
+    @abstractmethod
+    def insert_if_absent(self, table: str, row: dict, on_conflict: str) -> Optional[dict]:
+        """
+        Insert one row unless another row already has the same `on_conflict` value.
+
+        INSERT ... ON CONFLICT DO NOTHING: returns the stored row if this call
+        claimed the key, None if it was already taken. No exception is raised
+        for the expected conflict, so a rush on one key stays cheap.
+        """
+
+    @abstractmethod
+    def upsert(self, table: str, rows: List[dict], on_conflict: str) -> List[dict]:
+        """Insert rows, replacing existing ones that share the `on_conflict` key"""
+
+    @abstractmethod
+    def select(self, table: str, columns: str = "*", filters: Optional[Dict[str, Any]] = None,
+               order_by: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def update(self, table: str, values: dict, filters: Dict[str, Any]) -> List[dict]:
+        """Update the rows matching `filters`; returns the updated rows (empty if none matched)"""
+
+    @abstractmethod
+    def delete(self, table: str, filters: Dict[str, Any]) -> List[dict]:
+        """Delete the rows matching `filters`; returns the deleted rows (empty if none matched)"""
+
+    def delete_expired(self, table: str, older_than: datetime, status: str) -> List[dict]:
+        """Expiry sweep: delete rows in `status` created before `older_than` in one statement"""
+        return self.delete(table, {"created_at__lt": to_utc_iso(older_than), "status": status})
+
+    @abstractmethod
+    def ping(self):
+        """Cheapest possible round trip, for readiness probes; raises if the backend is unreachable"""
+
+
+class SupabaseStorage(Storage):
+    """Tables in Supabase, through the PostgREST query builder"""
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def _apply_filters(query, filters: Optional[Dict[str, Any]]):
+        for key, value in (filters or {}).items():
+            column, op = _split_filter(key)
+            query = getattr(query, "in_" if op == "in" else op)(column, value)
+        return query
+
+    def insert(self, table: str, row: dict) -> dict:
+        try:
+            return self.client.table(table).insert(row).execute().data[0]
+        except Exception as e:
+            if "duplicate key value violates unique constraint" in str(e):
+                raise DuplicateKeyError(str(e)) from e
+            raise
+
+    def insert_if_absent(self, table: str, row: dict, on_conflict: str) -> Optional[dict]:
+        # ignore_duplicates -> Prefer: resolution=ignore-duplicates -> ON CONFLICT DO NOTHING
+        rows = self.client.table(table).upsert(row, on_conflict=on_conflict, ignore_duplicates=True).execute().data
+        return rows[0] if rows else None
+
+    def upsert(self, table: str, rows: List[dict], on_conflict: str) -> List[dict]:
+        return self.client.table(table).upsert(rows, on_conflict=on_conflict).execute().data
+
+    def select(self, table: str, columns: str = "*", filters: Optional[Dict[str, Any]] = None,
+               order_by: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+        query = self._apply_filters(self.client.table(table).select(columns), filters)
+        if order_by:
+            query = query.order(order_by)
+        if limit:
+            query = query.limit(limit)
+        return query.execute().data
+
+    def update(self, table: str, values: dict, filters: Dict[str, Any]) -> List[dict]:
+        return self._apply_filters(self.client.table(table).update(values), filters).execute().data
+
+    def delete(self, table: str, filters: Dict[str, Any]) -> List[dict]:
+        return self._apply_filters(self.client.table(table).delete(), filters).execute().data
+
+    def ping(self):
+        self.client.table("bookings").select("booking_id").limit(1).execute()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payment_id TEXT UNIQUE NOT NULL,
+    user_id TEXT NOT NULL,
+    display_name TEXT NOT NULL,
+    selected_date TEXT NOT NULL,
+    amount REAL NOT NULL,
+    status TEXT DEFAULT 'pending',
+    status_code TEXT,
+    response TEXT,
+    created_at TEXT NOT NULL,
+    qr_code_url TEXT,
+    paid_at TEXT,
+    slip_url TEXT,
+    tran_ref TEXT,
+    metadata TEXT,
+    sender_bank TEXT,
+    sender_name TEXT,
+    receiver_name TEXT,
+    transaction_date TEXT,
+    fee REAL,
+    payload TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_payments_user_status ON payments (user_id, status);
+CREATE INDEX IF NOT EXISTS idx_payments_status_created ON payments (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_payments_created_at ON payments (created_at);
+CREATE INDEX IF NOT EXISTS idx_payments_tran_ref ON payments (tran_ref);
+
+CREATE TABLE IF NOT EXISTS bookings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    booking_id TEXT UNIQUE NOT NULL,
+    payment_id TEXT,
+    user_id TEXT NOT NULL,
+    display_name TEXT NOT NULL,
+    selected_date TEXT UNIQUE NOT NULL,
+    amount REAL NOT NULL,
+    status TEXT DEFAULT 'pending',
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_bookings_user_status ON bookings (user_id, status);
+CREATE INDEX IF NOT EXISTS idx_bookings_status_created ON bookings (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_bookings_created_at ON bookings (created_at);
+
+CREATE TABLE IF NOT EXISTS payment_slip_raw (
+    payment_id TEXT PRIMARY KEY,
+    easyslip_response TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+"""
+
+# Columns stored as JSON text in SQLite (JSONB in Supabase)
+SQLITE_JSON_COLUMNS = {"metadata", "easyslip_response"}
+
+_SQL_OPERATORS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+class SQLiteStorage(Storage):
+    """
+    Tables in a local SQLite database.
+
+    One connection in WAL mode, shared by worker threads behind a lock
+    (SQLite serializes writers anyway). WAL lets other processes, such as
+    reconcile_payments.py, read while the API writes.
+
+    Calls block on the lock and, while another process writes, for up to
+    busy_timeout (5s), so async code must run them with asyncio.to_thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(SQLITE_SCHEMA)
+        self._columns = {
+            table: {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for table in ("payments", "bookings", "payment_slip_raw")
+        }
+
+    def _table(self, table: str) -> str:
+        if table not in self._columns:
+            raise ValueError(f"Unknown table: {table}")
+        return table
+
+    def _column(self, table: str, column: str) -> str:
+        if column not in self._columns[table]:
+            raise ValueError(f"Unknown column {table}.{column}")
+        return column
+
+    def _select_list(self, table: str, columns: str) -> str:
+        if columns.strip() == "*":
+            return "*"
+        return ", ".join(self._column(table, column.strip()) for column in columns.split(","))
+
+    def _where(self, table: str, filters: Optional[Dict[str, Any]]) -> Tuple[str, list]:
+        clauses, params = [], []
+        for key, value in (filters or {}).items():
+            column, op = _split_filter(key)
+            column = self._column(table, column)
+            if op == "in":
+                values = list(value)
+                if not values:
+                    clauses.append("0")
+                    continue
+                clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+            else:
+                clauses.append(f"{column} {_SQL_OPERATORS[op]} ?")
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    @staticmethod
+    def _encode(row: dict) -> dict:
+        return {
+            column: json.dumps(value, ensure_ascii=False) if column in SQLITE_JSON_COLUMNS and value is not None else value
+            for column, value in row.items()
+        }
+
+    @staticmethod
+    def _decode(row: sqlite3.Row) -> dict:
+        data = dict(row)
+        for column in SQLITE_JSON_COLUMNS.intersection(data):
+            if data[column] is not None:
+                data[column] = json.loads(data[column])
+        return data
+
+    def _prepare(self, table: str, row: dict) -> dict:
+        row = self._encode(row)
+        if "created_at" in self._columns[table] and not row.get("created_at"):
+            row["created_at"] = utc_now_iso()
+        for column in row:
+            self._column(table, column)
+        return row
+
+    def _execute(self, sql: str, params: list) -> List[dict]:
+        with self._lock:
+            return [self._decode(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def insert(self, table: str, row: dict) -> dict:
+        table = self._table(table)
+        row = self._prepare(table, row)
+        sql = f"INSERT INTO {table} ({', '.join(row)}) VALUES ({', '.join('?' * len(row))}) RETURNING *"
+        try:
+            return self._execute(sql, list(row.values()))[0]
+        except sqlite3.IntegrityError as e:
+            if "UNIQUE constraint failed" in str(e):
+                raise DuplicateKeyError(str(e)) from e
+            raise
+
+    def insert_if_absent(self, table: str, row: dict, on_conflict: str) -> Optional[dict]:
+        table = self._table(table)
+        conflict_column = self._column(table, on_conflict)
+        row = self._prepare(table, row)
+        sql = (f"INSERT INTO {table} ({', '.join(row)}) VALUES ({', '.join('?' * len(row))}) "
+               f"ON CONFLICT ({conflict_column}) DO NOTHING RETURNING *")
+        rows = self._execute(sql, list(row.values()))
+        return rows[0] if rows else None
+
+    def upsert(self, table: str, rows: List[dict], on_conflict: str) -> List[dict]:
+        table = self._table(table)
+        conflict_column = self._column(table, on_conflict)
+        stored = []
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for row in rows:
+                    row = self._prepare(table, row)
+                    updates = ", ".join(f"{column} = excluded.{column}" for column in row if column != conflict_column)
+                    sql = (f"INSERT INTO {table} ({', '.join(row)}) VALUES ({', '.join('?' * len(row))}) "
+                           f"ON CONFLICT ({conflict_column}) DO UPDATE SET {updates} RETURNING *")
+                    stored.extend(self._decode(r) for r in self._conn.execute(sql, list(row.values())).fetchall())
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return stored
+
+    def select(self, table: str, columns: str = "*", filters: Optional[Dict[str, Any]] = None,
+               order_by: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+        table = self._table(table)
+        where, params = self._where(table, filters)
+        sql = f"SELECT {self._select_list(table, columns)} FROM {table}{where}"
+        if order_by:
+            sql += f" ORDER BY {self._column(table, order_by)}"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._execute(sql, params)
+
+    def update(self, table: str, values: dict, filters: Dict[str, Any]) -> List[dict]:
+        table = self._table(table)
+        values = self._encode(values)
+        assignments = ", ".join(f"{self._column(table, column)} = ?" for column in values)
+        where, params = self._where(table, filters)
+        return self._execute(f"UPDATE {table} SET {assignments}{where} RETURNING *", list(values.values()) + params)
+
+    def delete(self, table: str, filters: Dict[str, Any]) -> List[dict]:
+        table = self._table(table)
+        where, params = self._where(table, filters)
+        return self._execute(f"DELETE FROM {table}{where} RETURNING *", params)
+
+    def ping(self):
+        self._execute("SELECT 1", [])
+
+
+def create_storage(backend_name: str, supabase_client=None, sqlite_path: str = "clip_booking.db") -> Storage:
+    """Build the storage backend selected by STORAGE_BACKEND"""
+    if backend_name == "sqlite":
+        logger.info(f"Using SQLite storage at {sqlite_path}")
+        return SQLiteStorage(sqlite_path)
+    if backend_name != "supabase":
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend_name}")
+    if supabase_client is None:
+        raise ValueError("SUPABASE_URL and SUPABASE_ANON_KEY must be set in environment variables")
+    return SupabaseStorage(supabase_client)
@@ -0,0 +1,24 @@
+import os
+
+# main.py reads its configuration at import time: run it on an in-memory SQLite
+# database with no Supabase, EasySlip or background jobs
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", ":memory:")
+os.environ.setdefault("TIME_DIFF_LIMIT", "10")
+os.environ.setdefault("AMOUNT", "200")
+os.environ.setdefault("RECEIVER_NAME", "Test Receiver")
+os.environ.setdefault("CRON_ENABLED", "false")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+# Any endpoint that blocks the event loop fails the test that called it
+os.environ.setdefault("LOOP_MONITOR_STRICT", "true")
+
+import pytest
+
+
+@pytest.fixture
+def main_db():
+    """main.db with empty tables"""
+    import main
+    for table in ("payment_slip_raw", "payments", "bookings"):
+        main.db.delete(table, {})
+    yield main.db
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+import loop_monitor
+from health import HealthMonitor
+from loop_monitor import LoopMonitor
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(loop_monitor.time, "monotonic", clock)
+    return clock
+
+
+async def ok():
+    pass
+
+
+async def broken():
+    raise ConnectionError("connection refused")
+
+
+async def hangs():
+    await asyncio.sleep(10)
+
+
+def make_health(probes, required=("database",), **kwargs):
+    return HealthMonitor(probes, required, LoopMonitor(enabled=False), timeout=0.05, **kwargs)
+
+
+def add_lag(monitor: LoopMonitor, clock: FakeClock, lags_ms):
+    for lag_ms in lags_ms:
+        clock.now += monitor.interval
+        monitor._lag_samples.append((clock.now, lag_ms / 1000))
+
+
+def test_not_ready_until_required_probes_ran():
+    health = make_health({"database": ok})
+    report = health.readiness()
+    assert not report["ready"]
+    assert report["reasons"] == ["waiting for first probe: database"]
+
+    asyncio.run(health.probe_all())
+    assert health.readiness()["ready"]
+
+
+def test_failing_required_probe_is_not_ready():
+    health = make_health({"database": broken, "easyslip": ok}, required=("database", "easyslip"))
+    asyncio.run(health.probe_all())
+    report = health.readiness()
+    assert not report["ready"]
+    assert report["reasons"] == ["failing: database"]
+    assert report["checks"]["database"]["error"] == "connection refused"
+
+
+def test_failing_optional_probe_is_reported_but_ready():
+    health = make_health({"database": ok, "easyslip": hangs})
+    asyncio.run(health.probe_all())
+    report = health.readiness()
+    assert report["ready"]
+    easyslip = report["checks"]["easyslip"]
+    assert not easyslip["ok"] and not easyslip["required"]
+    assert "timed out" in easyslip["error"]
+
+
+def test_loop_lag_uses_recent_p99_not_latest_sample(clock):
+    health = make_health({"database": ok}, max_loop_lag_ms=500, loop_lag_window=5)
+    asyncio.run(health.probe_all())
+    monitor = health.loop_monitor
+
+    # A stall that has just ended: the latest sample is fine again
+    add_lag(monitor, clock, [1] * 10 + [1200, 2] + [1] * 5)
+    report = health.readiness()
+    assert not report["ready"]
+    assert "p99 1200ms" in report["reasons"][0]
+    assert report["event_loop_lag"]["current_ms"] == 1.0
+
+    # Once the stall is older than the window, readiness recovers
+    add_lag(monitor, clock, [1] * 101)
+    report = health.readiness()
+    assert report["ready"]
+    assert report["event_loop_lag"]["p99_ms"] == 1.0
+
+
+def test_lag_stats_window_is_capped_by_lag_window(clock):
+    monitor = LoopMonitor(enabled=False, interval=1.0, lag_window=10.0)
+    add_lag(monitor, clock, [100, 1, 1])
+    assert monitor.lag_stats(window=1.5)["max_ms"] == 1.0
+    assert monitor.lag_stats()["max_ms"] == 100.0
+    assert monitor.lag_stats(window=60)["window_seconds"] == 10.0
+    assert LoopMonitor(enabled=False).lag_stats()["p99_ms"] == 0.0
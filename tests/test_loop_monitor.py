@@ -0,0 +1,89 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from loop_monitor import EventLoopBlockedError, LoopMonitor, LoopMonitorMiddleware
+
+
+def make_app(monitor: LoopMonitor) -> FastAPI:
+    @asynccontextmanager
+    async def lifespan(app):
+        monitor.start()
+        yield
+        monitor.stop()
+
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(LoopMonitorMiddleware, monitor=monitor)
+
+    @app.get("/blocking")
+    async def blocking():
+        time.sleep(0.3)
+        return {"ok": True}
+
+    @app.get("/awaiting")
+    async def awaiting():
+        await asyncio.sleep(0.3)
+        return {"ok": True}
+
+    return app
+
+
+def test_strict_mode_fails_request_that_blocks_the_loop():
+    monitor = LoopMonitor(threshold=0.05, interval=0.01, strict=True)
+    with TestClient(make_app(monitor)) as client:
+        assert client.get("/awaiting").status_code == 200
+
+        with pytest.raises(EventLoopBlockedError, match="GET /blocking"):
+            client.get("/blocking")
+
+    report = monitor.report()
+    assert list(report["blocked_by_endpoint"]) == ["GET /blocking"]
+    assert any("time.sleep(0.3)" in line for line in report["recent_blocking_calls"][0]["stack"])
+
+
+def test_non_strict_mode_only_records():
+    monitor = LoopMonitor(threshold=0.05, interval=0.01, strict=False)
+    with TestClient(make_app(monitor)) as client:
+        assert client.get("/blocking").status_code == 200
+        time.sleep(0.05)
+        assert 'event_loop_blocking_calls_total{endpoint="GET /blocking"} 1' in monitor.prometheus_metrics()
+
+
+def test_api_endpoints_do_not_block_the_loop(main_db, monkeypatch):
+    import main
+
+    # Every Storage call takes longer than the block threshold, so a handler
+    # that calls the database on the loop thread fails under strict mode
+    latency = main.loop_monitor.threshold + 2 * main.loop_monitor.interval
+    for name in ("insert", "insert_if_absent", "upsert", "select", "update", "delete", "delete_expired"):
+        def slow(*args, _call=getattr(main_db, name), **kwargs):
+            time.sleep(latency)
+            return _call(*args, **kwargs)
+        monkeypatch.setattr(main_db, name, slow)
+
+    assert main.loop_monitor.strict
+    with TestClient(main.app) as client:
+        payment = {"user_id": "u1", "display_name": "User", "selected_date": "2025-08-01", "amount": 200, "qr_code_url": "https://qr.test/1.png"}
+        payment_id = client.post("/generate-payment", json=payment).json()[0]["payment_id"]
+        assert client.get(f"/payments/{payment_id}/raw").status_code == 404  # no slip yet
+        assert client.get("/payments").status_code == 200
+
+        booking = {"user_id": "u1", "display_name": "User", "selected_date": "2025-08-01", "amount": 200, "status": "pending"}
+        response = client.post("/create-booking", json=booking)
+        assert response.status_code == 200
+        assert client.post("/create-booking", json={**booking, "selected_date": "2025-08-02"}).status_code == 200
+        assert client.get("/bookings").status_code == 200
+        assert client.get("/bookings/user/u1/pending").status_code == 200
+        booking_id = response.json()["booking_id"]
+        assert client.put(f"/bookings/{booking_id}", data={"status": "confirmed"}).status_code == 200
+        assert client.delete(f"/bookings/{booking_id}").status_code == 200
+        assert client.post("/cleanup/old-bookings").status_code == 200
+
+        assert client.get("/health/live").status_code == 200
+        assert client.get("/metrics").status_code == 200
+        # Stack traces are opt-in
+        assert client.get("/debug/event-loop").status_code == 404
@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import rate_limit
+from rate_limit import ConcurrencyLimiter, InMemoryRateLimitBackend, RateLimit, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+def make_request(ip: str = "10.0.0.1", forwarded_for: str = None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded_for.encode())] if forwarded_for else []
+    return Request({"type": "http", "headers": headers, "client": (ip, 1234)})
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_token_bucket_burst_then_refill(clock):
+    backend = InMemoryRateLimitBackend()
+    limit = RateLimit(per_minute=60, burst=2)
+
+    assert run(backend.acquire("k", limit)) == 0
+    assert run(backend.acquire("k", limit)) == 0
+    assert run(backend.acquire("k", limit)) == pytest.approx(1.0)
+
+    clock.now += 0.5
+    assert run(backend.acquire("k", limit)) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert run(backend.acquire("k", limit)) == 0
+
+    # Refill is capped at the burst size
+    clock.now += 3600
+    assert [run(backend.acquire("k", limit)) for _ in range(3)][-1] > 0
+
+
+def test_acquire_all_charges_nothing_when_one_bucket_is_empty(clock):
+    backend = InMemoryRateLimitBackend()
+    tight, loose = RateLimit(per_minute=60, burst=1), RateLimit(per_minute=60, burst=5)
+
+    assert run(backend.acquire_all([("a", tight), ("b", loose)])) == 0
+    assert run(backend.acquire_all([("a", tight), ("b", loose)])) > 0
+    # "b" was only charged once, by the allowed request
+    assert [run(backend.acquire("b", loose)) for _ in range(4)] == [0, 0, 0, 0]
+    assert run(backend.acquire("b", loose)) > 0
+
+
+def test_check_raises_429_with_retry_after(clock):
+    limiter = RateLimiter(InMemoryRateLimitBackend(), limits={"verify_slip": RateLimit(per_minute=6, burst=1)})
+    run(limiter.check("verify_slip", make_request(), user_id="u1"))
+
+    with pytest.raises(HTTPException) as exc_info:
+        run(limiter.check("verify_slip", make_request(), user_id="u1"))
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.headers["Retry-After"] == "10"
+
+    # Other users are not affected
+    run(limiter.check("verify_slip", make_request(), user_id="u2"))
+
+
+def test_users_behind_one_ip_use_the_looser_ip_limit(clock):
+    limiter = RateLimiter(
+        InMemoryRateLimitBackend(),
+        limits={"create_booking": RateLimit(per_minute=10, burst=1)},
+        ip_limits={"create_booking": RateLimit(per_minute=60, burst=3)},
+    )
+    for user in ("u1", "u2", "u3"):
+        run(limiter.check("create_booking", make_request("172.18.0.1"), user_id=user))
+
+    with pytest.raises(HTTPException):
+        run(limiter.check("create_booking", make_request("172.18.0.1"), user_id="u4"))
+    # u4 was refused by the IP bucket, so its own token is still there
+    run(limiter.check("create_booking", make_request("10.9.9.9"), user_id="u4"))
+
+
+def test_check_without_user_id_uses_only_the_ip_bucket(clock):
+    limiter = RateLimiter(
+        InMemoryRateLimitBackend(),
+        limits={"verify_slip": RateLimit(per_minute=5, burst=1)},
+        ip_limits={"verify_slip": RateLimit(per_minute=60, burst=2)},
+    )
+    run(limiter.check("verify_slip", make_request()))
+    run(limiter.check("verify_slip", make_request()))
+    with pytest.raises(HTTPException):
+        run(limiter.check("verify_slip", make_request()))
+
+
+def test_client_ip_only_trusts_forwarded_for_behind_proxy():
+    request = make_request("172.18.0.1", forwarded_for="203.0.113.7, 172.18.0.1")
+    assert RateLimiter(None, {}).client_ip(request) == "172.18.0.1"
+    assert RateLimiter(None, {}, trust_proxy=True).client_ip(request) == "203.0.113.7"
+
+
+def test_check_fails_open_when_backend_errors():
+    class BrokenBackend:
+        async def acquire_all(self, buckets, cost=1):
+            raise ConnectionError("redis down")
+
+    limiter = RateLimiter(BrokenBackend(), limits={"verify_slip": RateLimit(per_minute=1, burst=1)})
+    run(limiter.check("verify_slip", make_request(), user_id="u1"))
+
+
+def test_concurrency_limiter_sheds_with_503():
+    async def scenario():
+        limiter = ConcurrencyLimiter("verify_slip", max_concurrency=2, retry_after=3)
+        async with limiter:
+            async with limiter:
+                with pytest.raises(HTTPException) as exc_info:
+                    async with limiter:
+                        pass
+                assert exc_info.value.status_code == 503
+                assert exc_info.value.headers["Retry-After"] == "3"
+        assert limiter.in_flight == 0
+        # Slots are released, also when the body raises
+        with pytest.raises(ValueError):
+            async with limiter:
+                raise ValueError
+        async with limiter:
+            assert limiter.in_flight == 1
+
+    run(scenario())
+
+
+def test_concurrency_limiter_zero_means_unlimited():
+    async def scenario():
+        limiter = ConcurrencyLimiter("create_booking", max_concurrency=0)
+        async with limiter, limiter, limiter:
+            assert limiter.in_flight == 3
+
+    run(scenario())
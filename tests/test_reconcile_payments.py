@@ -0,0 +1,72 @@
+import argparse
+import asyncio
+
+import httpx
+
+import reconcile_payments
+from main import EasySlipResponse
+
+SLIP_DATE = "2025-07-01T17:02:00+07:00"
+
+
+def easyslip_success(trans_ref: str) -> EasySlipResponse:
+    return EasySlipResponse.model_validate({
+        "status": 200,
+        "data": {
+            "payload": f"payload-{trans_ref}",
+            "transRef": trans_ref,
+            "date": SLIP_DATE,
+            "countryCode": "TH",
+            "amount": {"amount": 200},
+            "sender": {"bank": {"name": "Bank A"}, "account": {"name": {"th": "Sender"}}},
+            "receiver": {"bank": {"name": "Bank B"}, "account": {"name": {"th": "Test Receiver"}}},
+        },
+    })
+
+
+def make_args(tmp_path, **overrides) -> argparse.Namespace:
+    args = dict(
+        status=None, status_code=["500"], since=None, until=None, limit=0, page_size=2,
+        concurrency=4, rate_per_minute=6000, checkpoint=str(tmp_path / "checkpoint.json"),
+        resume=False, dry_run=False,
+    )
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
+def test_rows_sharing_a_slip_in_one_page_only_one_succeeds(main_db, tmp_path, monkeypatch):
+    # p0, p1 and p2 re-use the same slip; p0 and p1 are re-verified concurrently in the first page
+    slips = {"p0": "T1", "p1": "T1", "p2": "T1", "p3": "T2"}
+    for payment_id in slips:
+        main_db.insert("payments", {
+            "payment_id": payment_id,
+            "user_id": f"user-{payment_id}",
+            "display_name": payment_id,
+            "selected_date": "2025-07-02",
+            "amount": 200,
+            "status": "failed",
+            "status_code": "500",
+            "created_at": "2025-07-01T10:00:00+00:00",
+            "slip_url": f"https://storage.test/slips/{payment_id}.jpg",
+        })
+
+    async def fake_easyslip(content, filename, content_type, check_duplicate=True):
+        await asyncio.sleep(0.01)
+        return easyslip_success(slips[filename.rsplit(".", 1)[0]])
+
+    real_client = httpx.AsyncClient
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=b"\xff\xd8\xff\xe0slip"))
+    monkeypatch.setattr(reconcile_payments, "verify_slip_with_easyslip", fake_easyslip)
+    monkeypatch.setattr(reconcile_payments.httpx, "AsyncClient", lambda **kwargs: real_client(transport=transport, **kwargs))
+
+    stats = asyncio.run(reconcile_payments.Reconciler(make_args(tmp_path)).run())
+
+    rows = {row["payment_id"]: row for row in main_db.select("payments")}
+    t1_success = [pid for pid in ("p0", "p1", "p2") if rows[pid]["status"] == "success"]
+    assert len(t1_success) == 1
+    for pid in {"p0", "p1", "p2"} - set(t1_success):
+        assert rows[pid]["status"] == "failed"
+        assert rows[pid]["status_code"] == "400"
+        assert "already used" in rows[pid]["response"]
+    assert rows["p3"]["status"] == "success"
+    assert stats["success"] == 2 and stats["failed"] == 2
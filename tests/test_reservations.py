@@ -0,0 +1,153 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import main
+import reservations
+from rate_limit import ConcurrencyLimiter
+from reservations import DateReservations
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(reservations.time, "monotonic", clock)
+    return clock
+
+
+def counting_insert(result="row", delay=0.01):
+    calls = []
+
+    async def insert():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return result
+
+    return insert, calls
+
+
+def test_concurrent_claims_for_one_date_queue_on_one_insert():
+    async def scenario():
+        dates = DateReservations()
+        insert, calls = counting_insert()
+        results = await asyncio.gather(*(dates.claim("2025-08-01", insert) for _ in range(20)))
+        assert results.count("row") == 1
+        assert results.count(None) == 19
+        assert len(calls) == 1
+        # The per-date lock is dropped once nobody waits on it
+        assert dates._locks == {} and dates._lock_users == {}
+
+    asyncio.run(scenario())
+
+
+def test_date_taken_in_database_is_cached():
+    async def scenario():
+        dates = DateReservations()
+        insert, calls = counting_insert(result=None)
+        assert await asyncio.gather(*(dates.claim("2025-08-01", insert) for _ in range(5))) == [None] * 5
+        assert len(calls) == 1
+        assert dates.is_known_taken("2025-08-01")
+
+    asyncio.run(scenario())
+
+
+def test_different_dates_do_not_wait_for_each_other():
+    async def scenario():
+        dates = DateReservations()
+        insert, calls = counting_insert()
+        results = await asyncio.gather(*(dates.claim(f"2025-08-{day:02d}", insert) for day in range(1, 6)))
+        assert results == ["row"] * 5
+        assert len(calls) == 5
+
+    asyncio.run(scenario())
+
+
+def test_taken_cache_expires_after_ttl(clock):
+    async def scenario():
+        dates = DateReservations(taken_ttl=5.0)
+        insert, calls = counting_insert(delay=0)
+        await dates.claim("2025-08-01", insert)
+
+        clock.now += 4.9
+        assert await dates.claim("2025-08-01", insert) is None
+        assert len(calls) == 1
+
+        clock.now += 0.2
+        assert not dates.is_known_taken("2025-08-01")
+        await dates.claim("2025-08-01", insert)
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_zero_ttl_disables_the_cache():
+    dates = DateReservations(taken_ttl=0)
+    dates.mark_taken("2025-08-01")
+    assert not dates.is_known_taken("2025-08-01")
+
+
+def test_release_forgets_a_taken_date():
+    dates = DateReservations()
+    dates.mark_taken("2025-08-01")
+    dates.release("2025-08-01")
+    assert not dates.is_known_taken("2025-08-01")
+    dates.release(None)
+
+
+def test_failed_insert_lets_the_next_waiter_try():
+    async def scenario():
+        dates = DateReservations()
+        calls = []
+
+        async def insert():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            if len(calls) == 1:
+                raise ConnectionError("database unavailable")
+            return "row"
+
+        results = await asyncio.gather(*(dates.claim("2025-08-01", insert) for _ in range(3)), return_exceptions=True)
+        assert isinstance(results[0], ConnectionError)
+        assert results[1:] == ["row", None]
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_same_date_rush_is_not_shed_by_the_booking_cap(main_db, monkeypatch):
+    insert_if_absent = main_db.insert_if_absent
+
+    def slow_insert_if_absent(*args, **kwargs):
+        time.sleep(0.05)
+        return insert_if_absent(*args, **kwargs)
+
+    monkeypatch.setattr(main_db, "insert_if_absent", slow_insert_if_absent)
+    monkeypatch.setattr(main, "booking_concurrency", ConcurrencyLimiter("create_booking", max_concurrency=2))
+    monkeypatch.setattr(main, "date_reservations", DateReservations())
+
+    async def rush():
+        async with httpx.AsyncClient(app=main.app, base_url="http://test") as client:
+            async def book(date: str, i: int):
+                response = await client.post("/create-booking", json={
+                    "user_id": f"u{i}", "display_name": "User", "selected_date": date, "amount": 200, "status": "pending",
+                })
+                return response.status_code
+
+            same_date = await asyncio.gather(*(book("2025-08-01", i) for i in range(30)))
+            distinct_dates = await asyncio.gather(*(book(f"2025-09-{i + 1:02d}", i) for i in range(4)))
+            return same_date, distinct_dates
+
+    same_date, distinct_dates = asyncio.run(rush())
+    assert sorted(same_date) == [200] + [409] * 29
+    # Inserts for different dates still count against the cap
+    assert distinct_dates.count(503) == 2
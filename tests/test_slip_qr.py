@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+import main
+from slip_qr import RecentTransRefs, _crc16_ccitt, _parse_tlv, parse_slip_payload
+
+# Sample payload from API_DOCUMENTATION.md
+SLIP_PAYLOAD = "0038000600000101030060217A4fa65d187c1549805102TH9104FCAF"
+TRANS_REF = "A4fa65d187c154980"
+# Dynamic PromptPay QR for paying 200 THB: a valid EMV QR, but not a slip
+PROMPTPAY_BODY = "00020101021229370016A000000677010111011300668123456785802TH5303764540520.006304"
+PROMPTPAY_PAYLOAD = PROMPTPAY_BODY + _crc16_ccitt(PROMPTPAY_BODY)
+
+
+def test_crc16_ccitt():
+    assert _crc16_ccitt("123456789") == "29B1"
+    assert _crc16_ccitt(SLIP_PAYLOAD[:-4]) == "FCAF"
+
+
+def test_parse_tlv():
+    assert _parse_tlv("0002ab5102TH") == {"00": "ab", "51": "TH"}
+    assert _parse_tlv("") == {}
+    assert _parse_tlv("0005ab") is None  # value shorter than its length
+    assert _parse_tlv("00") is None  # truncated header
+    assert _parse_tlv("00x2ab") is None  # non-numeric length
+
+
+def test_parse_valid_slip_payload():
+    slip = parse_slip_payload(SLIP_PAYLOAD)
+    assert slip.trans_ref == TRANS_REF
+    assert slip.sending_bank == "006"
+    assert slip.country_code == "TH"
+    assert slip.payload == SLIP_PAYLOAD
+
+
+def test_parse_lowercase_crc():
+    assert parse_slip_payload(SLIP_PAYLOAD[:-4] + "fcaf").trans_ref == TRANS_REF
+
+
+@pytest.mark.parametrize("payload", [
+    SLIP_PAYLOAD[:-4] + "FCAE",  # bad CRC
+    SLIP_PAYLOAD.replace("A4fa", "A4fb"),  # tampered body
+    "",
+    PROMPTPAY_PAYLOAD,
+])
+def test_parse_rejects_invalid_payload(payload):
+    assert parse_slip_payload(payload) is None
+
+
+def test_parse_rejects_truncated_tlv_with_valid_crc():
+    # "00" claims 38 characters but only 10 follow
+    body = "00380006000001019104"
+    assert parse_slip_payload(body + _crc16_ccitt(body)) is None
+
+
+def test_parse_rejects_slip_without_trans_ref():
+    body = "001000060000010151" + "02TH9104"
+    assert parse_slip_payload(body + _crc16_ccitt(body)) is None
+
+
+def test_recent_trans_refs_evicts_least_recently_added():
+    refs = RecentTransRefs(max_size=2)
+    refs.add("a")
+    refs.add("b")
+    refs.add("a")
+    refs.add("c")
+    assert "a" in refs and "c" in refs
+    assert "b" not in refs
+
+
+@pytest.fixture
+def precheck(monkeypatch, main_db):
+    """precheck_slip with the QR decoder replaced by one returning `decoded["payload"]`"""
+    decoded = {"payload": SLIP_PAYLOAD}
+
+    async def decode(content):
+        return decoded["payload"]
+
+    monkeypatch.setattr(main.slip_qr_decoder, "enabled", True)
+    monkeypatch.setattr(main.slip_qr_decoder, "decode", decode)
+    monkeypatch.setattr(main, "verified_trans_refs", RecentTransRefs())
+
+    def run(payload=SLIP_PAYLOAD):
+        decoded["payload"] = payload
+        result = asyncio.run(main.precheck_slip(b"image"))
+        return result.message if result else None
+
+    return run
+
+
+def add_payment(db, status: str):
+    db.insert("payments", {
+        "payment_id": f"p-{status}", "user_id": "u", "display_name": "d",
+        "selected_date": "2025-08-01", "amount": 200, "status": status, "tran_ref": TRANS_REF,
+    })
+
+
+def test_precheck_passes_new_slip(precheck):
+    assert precheck() is None
+
+
+def test_precheck_rejects_promptpay_qr(precheck):
+    assert precheck(PROMPTPAY_PAYLOAD) == "invalid_payload"
+
+
+def test_precheck_unreadable_qr(precheck, monkeypatch):
+    assert precheck(None) == "qrcode_not_found"
+    monkeypatch.setattr(main, "SLIP_QR_REJECT_UNREADABLE", False)
+    assert precheck(None) is None
+
+
+def test_precheck_duplicate_from_database(precheck, main_db):
+    add_payment(main_db, "pending")
+    assert precheck() is None
+
+    add_payment(main_db, "success")
+    assert precheck() == "duplicate_slip"
+    assert TRANS_REF in main.verified_trans_refs
+
+
+def test_precheck_duplicate_from_lru_skips_database(precheck, main_db, monkeypatch):
+    main.verified_trans_refs.add(TRANS_REF)
+
+    def select(*args, **kwargs):
+        raise AssertionError("database queried for a slip already in the LRU")
+
+    monkeypatch.setattr(main_db, "select", select)
+    assert precheck() == "duplicate_slip"
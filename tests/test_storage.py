@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from storage import DuplicateKeyError, SQLiteStorage, Storage
+
+
+@pytest.fixture
+def db():
+    return SQLiteStorage(":memory:")
+
+
+def make_booking(n: int, **overrides) -> dict:
+    booking = {
+        "booking_id": f"b{n}",
+        "user_id": f"user{n % 2}",
+        "display_name": f"User {n}",
+        "selected_date": f"2025-08-{n + 1:02d}",
+        "amount": 100 * (n + 1),
+        "status": "pending",
+    }
+    booking.update(overrides)
+    return booking
+
+
+def ids(rows) -> list:
+    return sorted(row["booking_id"] for row in rows)
+
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        Storage()
+
+
+@pytest.mark.parametrize("filters, expected", [
+    ({"user_id": "user0"}, ["b0", "b2"]),
+    ({"user_id__eq": "user1"}, ["b1", "b3"]),
+    ({"status__neq": "pending"}, ["b3"]),
+    ({"amount__gt": 200}, ["b2", "b3"]),
+    ({"amount__gte": 200}, ["b1", "b2", "b3"]),
+    ({"amount__lt": 200}, ["b0"]),
+    ({"amount__lte": 200}, ["b0", "b1"]),
+    ({"booking_id__in": ["b0", "b3", "missing"]}, ["b0", "b3"]),
+    ({"booking_id__in": []}, []),
+    ({"user_id": "user0", "amount__gt": 100}, ["b2"]),
+])
+def test_select_filters(db, filters, expected):
+    for n in range(4):
+        db.insert("bookings", make_booking(n, status="confirmed" if n == 3 else "pending"))
+    assert ids(db.select("bookings", filters=filters)) == expected
+
+
+def test_select_rejects_unknown_operator_and_column(db):
+    with pytest.raises(ValueError):
+        db.select("bookings", filters={"amount__like": 1})
+    with pytest.raises(ValueError):
+        db.select("bookings", filters={"nope": 1})
+
+
+def test_select_columns_order_and_limit(db):
+    for n in (2, 0, 1):
+        db.insert("bookings", make_booking(n))
+    rows = db.select("bookings", "booking_id, amount", order_by="amount", limit=2)
+    assert rows == [{"booking_id": "b0", "amount": 100}, {"booking_id": "b1", "amount": 200}]
+
+
+def test_insert_fills_created_at_in_utc(db):
+    row = db.insert("bookings", make_booking(0))
+    created_at = datetime.fromisoformat(row["created_at"])
+    assert created_at.tzinfo is None
+    assert abs(created_at - datetime.now(timezone.utc).replace(tzinfo=None)) < timedelta(minutes=1)
+
+
+def test_insert_raises_duplicate_key(db):
+    db.insert("bookings", make_booking(0))
+    with pytest.raises(DuplicateKeyError):
+        db.insert("bookings", make_booking(0))
+
+
+def test_insert_if_absent_returns_none_on_conflict(db):
+    first = db.insert_if_absent("bookings", make_booking(0), "selected_date")
+    assert first["booking_id"] == "b0"
+    second = db.insert_if_absent("bookings", make_booking(1, selected_date=first["selected_date"]), "selected_date")
+    assert second is None
+    assert ids(db.select("bookings")) == ["b0"]
+
+
+def test_upsert_replaces_on_conflict(db):
+    db.insert("bookings", make_booking(0))
+    stored = db.upsert("bookings", [make_booking(0, status="confirmed"), make_booking(1)], "booking_id")
+    assert ids(stored) == ["b0", "b1"]
+    assert db.select("bookings", "status", {"booking_id": "b0"}) == [{"status": "confirmed"}]
+
+
+def test_update_returns_affected_rows(db):
+    for n in range(3):
+        db.insert("bookings", make_booking(n))
+    updated = db.update("bookings", {"status": "confirmed"}, {"user_id": "user0"})
+    assert ids(updated) == ["b0", "b2"]
+    assert all(row["status"] == "confirmed" for row in updated)
+    assert db.update("bookings", {"status": "confirmed"}, {"booking_id": "missing"}) == []
+
+
+def test_delete_returns_affected_rows(db):
+    for n in range(3):
+        db.insert("bookings", make_booking(n))
+    assert ids(db.delete("bookings", {"booking_id": "b1"})) == ["b1"]
+    assert db.delete("bookings", {"booking_id": "b1"}) == []
+    assert ids(db.select("bookings")) == ["b0", "b2"]
+
+
+def test_delete_expired_only_removes_old_rows_in_status(db):
+    now = datetime.now(timezone.utc)
+    old = (now - timedelta(minutes=30)).replace(tzinfo=None).isoformat()
+    db.insert("bookings", make_booking(0, created_at=old))
+    db.insert("bookings", make_booking(1, created_at=old, status="confirmed"))
+    db.insert("bookings", make_booking(2))
+
+    deleted = db.delete_expired("bookings", older_than=now - timedelta(minutes=10), status="pending")
+
+    assert ids(deleted) == ["b0"]
+    assert ids(db.select("bookings")) == ["b1", "b2"]
+
+
+def test_json_columns_round_trip(db):
+    payment = {
+        "payment_id": "p0", "user_id": "u", "display_name": "d", "selected_date": "2025-08-01",
+        "amount": 200, "metadata": {"sender_name": "ผู้โอน", "fee": 0},
+    }
+    assert db.insert("payments", payment)["metadata"] == payment["metadata"]
+    assert db.select("payments", "metadata")[0]["metadata"] == payment["metadata"]
+
+
+def test_ping(db):
+    db.ping()
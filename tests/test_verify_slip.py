@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+
+import main
+from main import EasySlipResponse
+
+JPEG = b"\xff\xd8\xff\xe0slip"
+
+
+def easyslip_success(trans_ref: str) -> EasySlipResponse:
+    slip_date = datetime.now(timezone(timedelta(hours=7))).isoformat()
+    return EasySlipResponse.model_validate({
+        "status": 200,
+        "data": {
+            "payload": f"payload-{trans_ref}",
+            "transRef": trans_ref,
+            "date": slip_date,
+            "countryCode": "TH",
+            "amount": {"amount": 200},
+            "sender": {"bank": {"name": "Bank A"}, "account": {"name": {"th": "Sender"}}},
+            "receiver": {"bank": {"name": "Bank B"}, "account": {"name": {"th": "Test Receiver"}}},
+        },
+    })
+
+
+def test_raw_response_failure_does_not_fail_recorded_payment(main_db, monkeypatch):
+    async def fake_easyslip(content, filename, content_type, check_duplicate=True):
+        return easyslip_success("T1")
+
+    async def fake_upload(**kwargs):
+        return None
+
+    def broken_upsert(table, rows, on_conflict):
+        raise ConnectionError("payment_slip_raw unavailable")
+
+    monkeypatch.setattr(main, "PAYMENT_METADATA_MODE", "compact")
+    monkeypatch.setattr(main.slip_preprocessor, "enabled", False)
+    monkeypatch.setattr(main, "verify_slip_with_easyslip", fake_easyslip)
+    monkeypatch.setattr(main, "upload_file_to_supabase_storage", fake_upload)
+    monkeypatch.setattr(main_db, "upsert", broken_upsert)
+
+    form = {"payment_id": "p1", "user_id": "u1", "display_name": "User", "selected_date": "2025-08-01", "amount": "200"}
+    with TestClient(main.app) as client:
+        response = client.post("/verify-slip-with-validation", data=form, files={"slip_image": ("slip.jpg", JPEG, "image/jpeg")})
+
+    assert response.status_code == 200
+    assert response.json()["success"] is True
+    assert main_db.select("payments", "status, tran_ref", {"payment_id": "p1"}) == [{"status": "success", "tran_ref": "T1"}]